@@ -1,4 +1,4 @@
-import cmd, os, json, bcrypt, shlex, re, copy
+import os, sys, json, shlex, re, copy, errno, hashlib, struct, zlib, functools, itertools, time, array
 
 OPEN_TAG = '<morlock>'
 CLOSE_TAG = '</morlock>'
@@ -7,161 +7,1659 @@ DEFAULT = {
     "password": None, 
     "data": {} 
 }
-EXTENSIONS = { 
-    'mp3': [ 
+CHUNK_SIZE = 64 * 1024
+
+# Files handled at once by commands streaming over whole libraries
+BATCH_SIZE = 256
+
+# Framed header: magic, version, flags, payload length, payload CRC32, padding length
+FRAME = struct.Struct('>4sBBIII')
+FRAME_MAGIC = b'MRLK'
+FRAME_VERSION = 1
+
+# Payload codecs, recorded in the frame's flags byte
+FLAG_BINARY = 0x01
+FLAG_ZLIB = 0x10
+CODECS = {
+    'json': 0,
+    'binary': FLAG_BINARY,
+    'json+zlib': FLAG_ZLIB,
+    'binary+zlib': FLAG_BINARY | FLAG_ZLIB
+}
+
+class Phase:
+    'One timed run of a phase; callers add what it read and wrote'
+
+    __slots__ = ('stats', 'name', 'path', 'count', 'read', 'written', 'start')
+
+    def __init__(self, stats: 'MorlockStats', name: str, path: str) -> None:
+        self.stats = stats
+        self.name = name
+        self.path = path
+        self.count = 1
+        self.read = 0
+        self.written = 0
+
+    def __enter__(self) -> 'Phase':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stats.record(self, time.perf_counter() - self.start)
+
+class NullPhase:
+    'Stands in for Phase while stats are off, so instrumented code costs a method call'
+
+    __slots__ = ('count', 'read', 'written')
+
+    def __enter__(self) -> 'NullPhase':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+class MorlockStats:
+    """Counters, cumulative timings and bytes read/written of hot-path
+    phases (e.g. `load.read`), optionally traced as JSON lines to a file.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.phases: dict[str, list] = {}
+        self.trace = None
+        self.lock = None
+        self.null = NullPhase()
+
+    def enable(self, trace: str = None) -> None:
+        import threading
+
+        self.lock = self.lock or threading.Lock()
+        self.enabled = True
+
+        if trace is not None:
+            self.closetrace()
+            self.trace = open(trace, 'a', buffering=1, encoding='utf-8')
+
+    def disable(self) -> None:
+        self.enabled = False
+        self.closetrace()
+
+    def closetrace(self) -> None:
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    def phase(self, name: str, path: str = None):
+        'Time a `with` block as a run of phase `name`'
+        return Phase(self, name, path) if self.enabled else self.null
+
+    def add(self, name: str, count: int = 1, seconds: float = 0, read: int = 0, written: int = 0) -> None:
+        'Count untimed events, e.g. passwords found in the unlock cache'
+
+        if not self.enabled:
+            return
+
+        with self.lock:
+            totals = self.phases.setdefault(name, [0, 0.0, 0, 0])
+            totals[0] += count
+            totals[1] += seconds
+            totals[2] += read
+            totals[3] += written
+
+    def record(self, phase: Phase, seconds: float) -> None:
+        self.add(phase.name, phase.count, seconds, phase.read, phase.written)
+
+        if self.trace is not None:
+            line = {'time': time.time(), 'phase': phase.name, 'path': phase.path, 'count': phase.count,
+                    'seconds': seconds, 'read': phase.read, 'written': phase.written}
+            with self.lock:
+                self.trace.write(json.dumps(line, ensure_ascii=False) + '\n')
+
+STATS = MorlockStats()
+
+def readat(f, offset: int, size: int) -> bytes:
+    'Read `size` bytes at `offset` of `f` without moving its position'
+
+    position = f.tell()
+    f.seek(offset)
+    data = f.read(size)
+    f.seek(position)
+
+    return data
+
+class Container:
+    """Audio container format, keyed by extension in `CONTAINERS`.
+    `parse` recognises the container from its own headers, reading a few
+    bytes at known offsets. `sigs` are only used to scan for the audio in
+    tag-delimited headers that `parse` can't place.
+    """
+
+    sigs: list[bytes] = []
+
+    def parse(self, f, offset: int = 0) -> int:
+        'Return where the encoded audio begins if a stream of this format starts at `offset`, else None'
+        raise NotImplementedError
+
+class Mp3Container(Container):
+    sigs = [
         b'ID3',
         b'\xc3\xbf\xc3\xbb',
         b'\xc3\xbf\xc3\xb3',
         b'\xc3\xbf\xc3\xb2'
-    ], 
-    'ogg': [ b'OggS' ],
-    #'flac': [ b'fLaC' ],
-    #'wav': [ b'RIFF\x06\xc1O\x00WAVE' ]
+    ]
+
+    def parse(self, f, offset: int = 0) -> int:
+        head = readat(f, offset, 10)
+
+        # ID3v2 tag: 'ID3', version, revision, flags and a syncsafe size
+        if len(head) == 10 and head.startswith(b'ID3'):
+            major, revision, flags = head[3], head[4], head[5]
+            if major not in (2, 3, 4) or revision == 0xff or any(b & 0x80 for b in head[6:]):
+                return None
+
+            size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+            footer = 10 if flags & 0x10 else 0
+            return offset + 10 + size + footer
+
+        # Bare MPEG audio frame: 11 sync bits, then no reserved version, layer, bitrate or rate
+        if len(head) >= 4 and head[0] == 0xff and head[1] & 0xe0 == 0xe0:
+            version, layer = (head[1] >> 3) & 3, (head[1] >> 1) & 3
+            bitrate, rate = head[2] >> 4, (head[2] >> 2) & 3
+            if version != 1 and layer != 0 and bitrate != 0xf and rate != 3:
+                return offset
+
+        return None
+
+class OggContainer(Container):
+    sigs = [ b'OggS' ]
+
+    def parse(self, f, offset: int = 0) -> int:
+        # Page header: 'OggS', version, type, granule, serial, sequence, CRC and segment count
+        head = readat(f, offset, 27)
+        if len(head) < 27 or not head.startswith(b'OggS') or head[4] != 0:
+            return None
+
+        # A stream must open with a beginning-of-stream page
+        if head[5] & ~0x07 or not head[5] & 0x02:
+            return None
+
+        segments = head[26]
+        if len(readat(f, offset + 27, segments)) < segments:
+            return None
+
+        return offset + 27 + segments
+
+class FlacContainer(Container):
+    sigs = [ b'fLaC' ]
+
+    def parse(self, f, offset: int = 0) -> int:
+        if readat(f, offset, 4) != b'fLaC':
+            return None
+
+        # Skipping metadata blocks (STREAMINFO first) by their 24-bit lengths
+        position = offset + 4
+        first = True
+        while True:
+            block = readat(f, position, 4)
+            if len(block) < 4:
+                return None
+
+            kind, size = block[0] & 0x7f, int.from_bytes(block[1:], 'big')
+            if kind == 0x7f or (first and (kind != 0 or size != 34)):
+                return None
+
+            position += 4 + size
+            first = False
+
+            if block[0] & 0x80:
+                return position
+
+class WavContainer(Container):
+    sigs = [ b'RIFF' ]
+
+    def parse(self, f, offset: int = 0) -> int:
+        head = readat(f, offset, 12)
+        if len(head) < 12 or not head.startswith(b'RIFF') or head[8:] != b'WAVE':
+            return None
+
+        # Skipping chunks (word-aligned) by their little-endian lengths until `data`
+        position = offset + 12
+        while True:
+            chunk = readat(f, position, 8)
+            if len(chunk) < 8:
+                return None
+
+            size = int.from_bytes(chunk[4:], 'little')
+            if chunk.startswith(b'data'):
+                return position + 8
+
+            position += 8 + size + (size & 1)
+
+CONTAINERS = {
+    'mp3': Mp3Container(),
+    'ogg': OggContainer(),
+    'flac': FlacContainer(),
+    'wav': WavContainer()
 }
 
+def locateheader(byte: bytes, sigs: list[bytes]) -> tuple[int, int, int]:
+    """Find the Morlock header of a file's content using offsets only.
+    Returns `(start, end, audiostart)`: the bounds of the text between the
+    tags and the offset at which the audio starts (None if no signature
+    follows the header). Returns None if the file has no Morlock content.
+    """
+
+    open_tag = OPEN_TAG.encode('utf-8')
+    close_tag = CLOSE_TAG.encode('utf-8')
+
+    start = byte.find(open_tag)
+    first = byte.find(close_tag)
+    if start == -1 or first == -1:
+        return None
+
+    start += len(open_tag)
+    end = first if first >= start else byte.find(close_tag, start)
+    if end == -1:
+        return start, start, None
+
+    # The audio starts at the first signature (in order of preference) after the header
+    audiostart = None
+    for sig in sigs:
+        idx = byte.find(sig, end + len(close_tag))
+        if idx != -1:
+            audiostart = idx
+            break
+
+    if audiostart is None:
+        return start, end, None
+
+    # The header ends at the last closing tag before the audio
+    end = byte.rfind(close_tag, start, audiostart)
+    return start, end, audiostart
+
+def readframe(f, head: bytearray) -> tuple[bytearray, tuple[int, int, int], int, int, int]:
+    'Read the payload of a framed header whose fixed part is already in `head`'
+
+    if len(head) < FRAME.size:
+        return head, (len(head), len(head), None), len(head), 0, 0
+
+    _, version, flags, length, crc, padding = FRAME.unpack_from(head)
+    start = FRAME.size
+    end = start + length
+
+    # The frame gives its own size, so the payload is read in one go
+    head += f.read(end - len(head))
+    size = os.fstat(f.fileno()).st_size
+
+    # Checking integrity without parsing the payload
+    if version != FRAME_VERSION or len(head) < end or end + padding > size:
+        return head, (start, end, None), len(head), version, flags
+
+    if zlib.crc32(head[start:end]) != crc:
+        return head, (start, end, None), len(head), version, flags
+
+    return head, (start, end, end + padding), len(head), version, flags
+
+def readheader(path: str, container: Container) -> tuple[bytes, tuple[int, int, int], int, int, int]:
+    """Read a file only up to the end of its Morlock header.
+    Returns `(head, header, bytesread, version, flags)`, where `head` holds
+    the bytes read, `header` is what `locateheader` would return for the whole
+    file, `version` is the frame version (0 for tag-delimited headers) and
+    `flags` tell the payload's codec. Framed
+    headers are read by size. For tag-delimited ones, reading stops as soon as
+    a closing tag is directly followed by a stream `container` recognises; the
+    rest of the file is only scanned when that never happens.
+    """
+
+    open_tag = OPEN_TAG.encode('utf-8')
+    close_tag = CLOSE_TAG.encode('utf-8')
+    start = -1
+    searchfrom = 0
+
+    with open(path, 'rb') as f:
+        head = bytearray(f.read(FRAME.size))
+        if head.startswith(FRAME_MAGIC):
+            return readframe(f, head)
+
+        # Audio right at the start means there's no Morlock content
+        if container.parse(f, 0) is not None:
+            return head, None, len(head), 0, 0
+
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            head += chunk
+            eof = len(chunk) < CHUNK_SIZE
+
+            if start == -1:
+                start = head.find(open_tag)
+                if start != -1:
+                    searchfrom = start + len(open_tag)
+
+            # Looking for a closing tag immediately followed by audio
+            while start != -1:
+                end = head.find(close_tag, searchfrom)
+                if end == -1:
+                    searchfrom = max(searchfrom, len(head) - len(close_tag) + 1)
+                    break
+
+                audiostart = end + len(close_tag)
+                if container.parse(f, audiostart) is not None:
+                    return head, (start + len(open_tag), end, audiostart), len(head), 0, 0
+
+                searchfrom = audiostart
+
+            if eof:
+                break
+
+    # Falling back to scanning the whole file
+    with STATS.phase('load.scan', path):
+        header = locateheader(head, container.sigs)
+
+    return head, header, len(head), 0, 0
+
+def extractjson(header: bytes) -> dict:
+    'Decode the JSON object between the Morlock tags, skipping any leading garbage'
+
+    try:
+        text = header.decode('utf-8')
+    except UnicodeDecodeError:
+        text = header.decode('latin-1')
+
+    text = text.replace(OPEN_TAG, '').replace(CLOSE_TAG, '')
+    decoder = json.JSONDecoder()
+    idx = text.find('{')
+
+    # Trying each object start until one spans the rest of the header
+    while idx != -1:
+        try:
+            content, end = decoder.raw_decode(text, idx)
+        except ValueError:
+            pass
+        else:
+            if text[end:].strip() == '':
+                return content
+
+        idx = text.find('{', idx + 1)
+
+    return None
+
+def copytail(src: int, dst: int, offset: int, count: int) -> None:
+    'Copy `count` bytes from `offset` of `src` to the current position of `dst` without buffering them in Python'
+
+    # Kernel-side copies first, falling back to plain chunked reads
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while count > 0:
+                copied = os.copy_file_range(src, dst, count, offset)
+                if copied == 0:
+                    return
+
+                offset += copied
+                count -= copied
+
+            return
+        except OSError as e:
+            if e.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+                raise
+
+    if hasattr(os, 'sendfile'):
+        try:
+            while count > 0:
+                copied = os.sendfile(dst, src, offset, count)
+                if copied == 0:
+                    return
+
+                offset += copied
+                count -= copied
+
+            return
+        except OSError as e:
+            if e.errno not in (errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+
+    while count > 0:
+        chunk = os.pread(src, min(CHUNK_SIZE, count), offset)
+        if chunk == b'':
+            return
+
+        os.write(dst, chunk)
+        offset += len(chunk)
+        count -= len(chunk)
+
+def rewritefile(path: str, header: bytes, offset: int) -> None:
+    """Replace everything before `offset` in `path` with `header`.
+    The new file is streamed into a temporary file in the same directory and
+    renamed over the original, so a crash never leaves a half-written file.
+    Symlinks are followed, and hard-linked files are copied back in place
+    instead, so every link keeps seeing the new content.
+    """
+
+    import shutil, tempfile
+
+    path = os.path.realpath(path)
+    directory = os.path.dirname(path)
+    fd, tmppath = tempfile.mkstemp(prefix='.morlock-', suffix='.tmp', dir=directory)
+
+    try:
+        with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+            shutil.copymode(path, tmppath)
+            dst.write(header)
+            dst.flush()
+
+            st = os.fstat(src.fileno())
+            copytail(src.fileno(), dst.fileno(), offset, st.st_size - offset)
+            os.fsync(dst.fileno())
+
+        # Renaming would detach the other links, so the staged copy is written over the file itself
+        if st.st_nlink > 1:
+            with open(tmppath, 'rb') as src, open(path, 'r+b') as dst:
+                size = os.fstat(src.fileno()).st_size
+                copytail(src.fileno(), dst.fileno(), 0, size)
+                dst.truncate(size)
+                os.fsync(dst.fileno())
+
+            os.unlink(tmppath)
+            return
+
+        os.replace(tmppath, path)
+    except BaseException:
+        if os.path.exists(tmppath):
+            os.unlink(tmppath)
+        raise
+
+    # Making the rename itself durable
+    if hasattr(os, 'O_DIRECTORY'):
+        dirfd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
+
+def mapordered(func, items: list, processes: bool = False) -> list:
+    'Apply `func` to every item on a thread (or process) pool, returning the results in input order'
+
+    if len(items) < 2:
+        return list(map(func, items))
+
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+    executor = ProcessPoolExecutor() if processes else ThreadPoolExecutor()
+    with executor:
+        return list(executor.map(func, items))
+
+def batches(items, size: int = BATCH_SIZE):
+    'Split any iterable into lists of up to `size` items, consuming it lazily'
+
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+
+        yield batch
+
+def checkpassword(item: tuple[str, str]) -> bool:
+    'Check a `(password, hash)` pair; picklable so it can run on a process pool'
+
+    import bcrypt
+
+    password, hashed = item
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+def hashpassword(password: str, rounds: int = 12) -> str:
+    'Hash a password with the given work factor; picklable so it can run on a process pool'
+
+    import bcrypt
+
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+# Binary payload values: a one-byte tag, then little-endian fields. Lists
+# and dicts give their item count and body size so readers can skip them;
+# lists of plain ints or floats are stored as packed arrays of the
+# narrowest fitting type.
+BYTE = struct.Struct('<B')
+UINT = struct.Struct('<I')
+INT32 = struct.Struct('<i')
+INT64 = struct.Struct('<q')
+FLOAT = struct.Struct('<d')
+SIZED = struct.Struct('<II')
+PACKED = struct.Struct('<cI')
+ARRAYS = ((b'b', -2**7), (b'h', -2**15), (b'i', -2**31), (b'q', -2**63))
+
+def encodebinary(value, out: bytearray) -> None:
+    'Append the binary encoding of a JSON value to `out`'
+
+    kind = type(value)
+
+    if kind is str:
+        raw = value.encode('utf-8')
+        if len(raw) < 256:
+            out += b'S' + BYTE.pack(len(raw)) + raw
+        else:
+            out += b's' + UINT.pack(len(raw)) + raw
+    elif kind is int:
+        if -2**31 <= value < 2**31:
+            out += b'j' + INT32.pack(value)
+        elif -2**63 <= value < 2**63:
+            out += b'i' + INT64.pack(value)
+        else:
+            raw = str(value).encode('ascii')
+            out += b'n' + UINT.pack(len(raw)) + raw
+    elif kind is float:
+        out += b'f' + FLOAT.pack(value)
+    elif value is None:
+        out += b'N'
+    elif value is True:
+        out += b'T'
+    elif value is False:
+        out += b'F'
+    elif kind is dict:
+        out += b'd'
+        mark = len(out)
+        out += bytes(SIZED.size)
+
+        for key, item in value.items():
+            raw = key.encode('utf-8')
+            if len(raw) < 255:
+                out += BYTE.pack(len(raw)) + raw
+            else:
+                out += b'\xff' + UINT.pack(len(raw)) + raw
+
+            encodebinary(item, out)
+
+        SIZED.pack_into(out, mark, len(value), len(out) - mark - SIZED.size)
+    elif kind is list:
+        if not packarray(value, out):
+            out += b'l'
+            mark = len(out)
+            out += bytes(SIZED.size)
+
+            for item in value:
+                encodebinary(item, out)
+
+            SIZED.pack_into(out, mark, len(value), len(out) - mark - SIZED.size)
+    else:
+        raise TypeError('Object of type {} is not JSON serializable'.format(kind.__name__))
+
+def packarray(value: list, out: bytearray) -> bool:
+    'Append a list of only ints or only floats as a packed array; False for any other list'
+
+    if len(value) < 4:
+        return False
+
+    kind = type(value[0])
+    if not kind in (int, float) or not all(type(item) is kind for item in value):
+        return False
+
+    if kind is float:
+        typecode = b'd'
+    else:
+        low, high = min(value), max(value)
+        typecode = next((code for code, bound in ARRAYS if bound <= low and high < -bound), None)
+        if typecode is None:
+            return False
+
+    packed = array.array(typecode.decode('ascii'), value)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+
+    out += b'A' + PACKED.pack(typecode, len(value)) + packed.tobytes()
+    return True
+
+def decodebinary(view: memoryview, pos: int = 0) -> tuple:
+    'Decode the binary value at `pos`; returns it and the position right after it'
+
+    tag = view[pos]
+    pos += 1
+
+    if tag == 0x53: # S
+        end = pos + 1 + view[pos]
+        return str(view[pos + 1:end], 'utf-8'), end
+
+    if tag == 0x6a: # j
+        return INT32.unpack_from(view, pos)[0], pos + INT32.size
+
+    if tag == 0x64: # d
+        count, size = SIZED.unpack_from(view, pos)
+        pos += SIZED.size
+        if count > size or pos + size > len(view):
+            raise ValueError('Truncated container.')
+
+        value = {}
+        for _ in range(count):
+            size = view[pos]
+            pos += 1
+            if size == 0xff:
+                size, = UINT.unpack_from(view, pos)
+                pos += UINT.size
+
+            key = str(view[pos:pos + size], 'utf-8')
+            value[key], pos = decodebinary(view, pos + size)
+
+        return value, pos
+
+    if tag == 0x6c: # l
+        count, size = SIZED.unpack_from(view, pos)
+        pos += SIZED.size
+        if count > size or pos + size > len(view):
+            raise ValueError('Truncated container.')
+
+        value = [None] * count
+        for i in range(count):
+            value[i], pos = decodebinary(view, pos)
+
+        return value, pos
+
+    if tag == 0x41: # A
+        typecode, count = PACKED.unpack_from(view, pos)
+        packed = array.array(typecode.decode('ascii'))
+        pos += PACKED.size
+        end = pos + count * packed.itemsize
+        if typecode not in b'bhiqd' or end > len(view):
+            raise ValueError('Invalid array.')
+
+        packed.frombytes(view[pos:end])
+        if sys.byteorder == 'big':
+            packed.byteswap()
+
+        return packed.tolist(), end
+
+    if tag == 0x66: # f
+        return FLOAT.unpack_from(view, pos)[0], pos + FLOAT.size
+
+    if tag == 0x73: # s
+        size, = UINT.unpack_from(view, pos)
+        pos += UINT.size
+        return str(view[pos:pos + size], 'utf-8'), pos + size
+
+    if tag == 0x69: # i
+        return INT64.unpack_from(view, pos)[0], pos + INT64.size
+
+    if tag == 0x4e: # N
+        return None, pos
+
+    if tag == 0x54: # T
+        return True, pos
+
+    if tag == 0x46: # F
+        return False, pos
+
+    if tag == 0x6e: # n
+        size, = UINT.unpack_from(view, pos)
+        pos += UINT.size
+        return int(str(view[pos:pos + size], 'ascii')), pos + size
+
+    raise ValueError('Unknown tag {!r}.'.format(chr(tag)))
+
+def skipbinary(view: memoryview, pos: int = 0) -> int:
+    'Return the position right after the binary value at `pos`, without decoding it'
+
+    tag = view[pos]
+    pos += 1
+
+    if tag == 0x64 or tag == 0x6c: # d, l
+        count, size = SIZED.unpack_from(view, pos)
+        end = pos + SIZED.size + size
+    elif tag == 0x41: # A
+        typecode, count = PACKED.unpack_from(view, pos)
+        if typecode not in b'bhiqd':
+            raise ValueError('Invalid array.')
+        end = pos + PACKED.size + count * array.array(typecode.decode('ascii')).itemsize
+    elif tag == 0x53: # S
+        end = pos + 1 + view[pos]
+    elif tag == 0x73 or tag == 0x6e: # s, n
+        end = pos + UINT.size + UINT.unpack_from(view, pos)[0]
+    elif tag == 0x6a: # j
+        end = pos + INT32.size
+    elif tag == 0x69 or tag == 0x66: # i, f
+        end = pos + INT64.size
+    elif tag in b'NTF':
+        end = pos
+    else:
+        raise ValueError('Unknown tag {!r}.'.format(chr(tag)))
+
+    if end > len(view):
+        raise ValueError('Truncated value.')
+
+    return end
+
+def seekbinary(view: memoryview, steps: tuple, pos: int = 0):
+    """Decode only the value at the compiled `steps` inside the binary value
+    at `pos`, skipping everything else; MorlockEmpty if there is none, like
+    `getkey`.
+    """
+
+    for i, step in enumerate(steps):
+        tag = view[pos]
+
+        if isinstance(step, int):
+            if tag == 0x41: # A
+                typecode, count = PACKED.unpack_from(view, pos + 1)
+                if step >= count or i + 1 < len(steps):
+                    return MorlockEmpty
+
+                packed = array.array(typecode.decode('ascii'))
+                start = pos + 1 + PACKED.size + step * packed.itemsize
+                packed.frombytes(view[start:start + packed.itemsize])
+                if sys.byteorder == 'big':
+                    packed.byteswap()
+
+                return packed[0]
+
+            if tag != 0x6c: # l
+                return MorlockEmpty
+
+            count, _ = SIZED.unpack_from(view, pos + 1)
+            if step >= count:
+                return MorlockEmpty
+
+            pos += 1 + SIZED.size
+            for _ in range(step):
+                pos = skipbinary(view, pos)
+            continue
+
+        if tag != 0x64: # d
+            return MorlockEmpty
+
+        count, _ = SIZED.unpack_from(view, pos + 1)
+        pos += 1 + SIZED.size
+        key = step.encode('utf-8')
+
+        for _ in range(count):
+            size = view[pos]
+            pos += 1
+            if size == 0xff:
+                size, = UINT.unpack_from(view, pos)
+                pos += UINT.size
+
+            pos += size
+            if view[pos - size:pos] == key:
+                break
+
+            pos = skipbinary(view, pos)
+        else:
+            return MorlockEmpty
+
+    return decodebinary(view, pos)[0]
+
+class MorlockContent(dict):
+    """Header content whose `data` is still encoded. Until something reads
+    it, `raw` holds its binary encoding: saving writes those bytes back as
+    they were and `lookup` decodes only the values asked for. Reading `data`,
+    or going through the whole content, decodes it once and for all.
+    """
+
+    __slots__ = ('raw',)
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.raw = None
+
+    @property
+    def lazy(self) -> bool:
+        return self.raw is not None
+
+    def materialize(self) -> None:
+        if self.raw is None:
+            return
+
+        with STATS.phase('load.materialize') as phase:
+            data, _ = decodebinary(memoryview(self.raw))
+            phase.read = len(self.raw)
+
+        self.raw = None
+        dict.__setitem__(self, 'data', data)
+
+    def __missing__(self, key):
+        if key != 'data' or self.raw is None:
+            raise KeyError(key)
+
+        self.materialize()
+        return dict.__getitem__(self, 'data')
+
+    def __setitem__(self, key, value) -> None:
+        if key == 'data':
+            self.raw = None
+
+        dict.__setitem__(self, key, value)
+
+    def __contains__(self, key) -> bool:
+        return dict.__contains__(self, key) or key == 'data' and self.raw is not None
+
+    def __len__(self) -> int:
+        return dict.__len__(self) + (self.raw is not None)
+
+    # Anything going through the whole content gets `data` decoded
+    def __iter__(self):
+        self.materialize()
+        return dict.__iter__(self)
+
+    def keys(self):
+        self.materialize()
+        return dict.keys(self)
+
+    def values(self):
+        self.materialize()
+        return dict.values(self)
+
+    def items(self):
+        self.materialize()
+        return dict.items(self)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __repr__(self) -> str:
+        self.materialize()
+        return dict.__repr__(self)
+
+    def copy(self) -> dict:
+        self.materialize()
+        return dict(dict.items(self))
+
+    def __eq__(self, other) -> bool:
+        self.materialize()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other) -> bool:
+        self.materialize()
+        return dict.__ne__(self, other)
+
+    __hash__ = None
+
+def decodecontent(view: memoryview) -> tuple[MorlockContent, int]:
+    'Decode a binary header payload, keeping `data` encoded when it is a dict coming last'
+
+    if view[0] != 0x64: # d
+        return decodebinary(view)
+
+    count, size = SIZED.unpack_from(view, 1)
+    pos = 1 + SIZED.size
+    if count > size or pos + size > len(view):
+        raise ValueError('Truncated container.')
+
+    content = MorlockContent()
+    for i in range(count):
+        size = view[pos]
+        pos += 1
+        if size == 0xff:
+            size, = UINT.unpack_from(view, pos)
+            pos += UINT.size
+
+        key = str(view[pos:pos + size], 'utf-8')
+        pos += size
+
+        if key == 'data' and i + 1 == count and view[pos] == 0x64:
+            end = skipbinary(view, pos)
+            content.raw = bytes(view[pos:end])
+            pos = end
+        else:
+            value, pos = decodebinary(view, pos)
+            dict.__setitem__(content, key, value)
+
+    return content, pos
+
+def encodepayload(content: dict, flags: int = 0) -> bytes:
+    'Encode the payload of a framed header with the codec `flags` name'
+
+    if flags & FLAG_BINARY and isinstance(content, MorlockContent) and content.lazy:
+        # `data` was never decoded, so its bytes go back as they were, last
+        payload = bytearray()
+        encodebinary(dict(dict.items(content)), payload)
+        payload += BYTE.pack(4) + b'data' + content.raw
+
+        count, _ = SIZED.unpack_from(payload, 1)
+        SIZED.pack_into(payload, 1, count + 1, len(payload) - 1 - SIZED.size)
+        payload = bytes(payload)
+    elif flags & FLAG_BINARY:
+        payload = bytearray()
+        encodebinary(content.copy() if isinstance(content, MorlockContent) else content, payload)
+        payload = bytes(payload)
+    else:
+        payload = json.dumps(content, indent=None, separators=(',', ':')).encode('utf-8')
+
+    if flags & FLAG_ZLIB:
+        payload = zlib.compress(payload)
+
+    return payload
+
+def decodepayload(payload: bytes, flags: int = 0, lazy: bool = False) -> dict:
+    """Decode the payload of a framed header written with the codec `flags`
+    name. With `lazy`, binary payloads keep `data` encoded (see MorlockContent).
+    """
+
+    # Unknown flags come from a newer Morlock
+    if flags & ~(FLAG_BINARY | FLAG_ZLIB):
+        return None
+
+    try:
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+
+        if not flags & FLAG_BINARY:
+            return json.loads(payload.decode('utf-8'))
+
+        view = memoryview(payload)
+        content, end = decodecontent(view) if lazy else decodebinary(view)
+        return content if end == len(view) else None
+    except (ValueError, IndexError, RecursionError, struct.error, zlib.error):
+        return None
+
+class MorlockEmpty:
+    pass
+
+@functools.lru_cache(maxsize=1024)
+def compilekey(key: str) -> tuple:
+    """Compile a `set` key (e.g. `family.brothers[0].son`) into its steps:
+    strings for dict keys and ints for list indices. Raises ValueError with
+    a message for the user if the key is invalid.
+    """
+
+    # Checking for forbidden characters
+    if re.search(r"[^A-z\d.\[\]]", key) is not None:
+        raise ValueError('Forbidden characters found in given key. See `help set`')
+
+    steps = []
+    for part in key.split('.'):
+        # Key is of type key.a...z (aka dict)
+        if not '[' in part:
+            steps.append(part)
+            continue
+
+        # Key is of type key[a]...[z] (aka list); checking for keys with only
+        # opening/ closing bracket or [] without index
+        if not ']' in part or '[]' in part:
+            raise ValueError('Invalid key found. Aborting.')
+
+        # Checking for keys without identifier (e.g.: [0][1][2])
+        name, idxs = part.split('[', 1)
+        if name == '':
+            raise ValueError("'{}' is an invalid key.".format(part))
+
+        steps.append(name)
+        for idx in idxs[:-1].split(']['):
+            # If list index is not a digit (e.g lst['a']; correct -> lst.a)
+            if not idx.isdecimal():
+                raise ValueError('Forbidden non-digit index found. Aborting.')
+
+            steps.append(int(idx))
+
+    return tuple(steps)
+
+def rollback(undo: list, mark: int = 0) -> None:
+    'Undo the changes recorded after `mark`, most recent first'
+
+    while len(undo) > mark:
+        undo.pop()()
+
+def getkey(data: dict, steps: tuple):
+    'Return the value at the compiled `steps` inside `data`, or MorlockEmpty if there is none'
+
+    refr = data
+    for step in steps:
+        if isinstance(step, int):
+            if not isinstance(refr, list) or step >= len(refr):
+                return MorlockEmpty
+        elif not isinstance(refr, dict) or not step in refr:
+            return MorlockEmpty
+
+        refr = refr[step]
+
+    return refr
+
+def lookup(content: dict, steps: tuple):
+    'Like `getkey` on the `data` of `content`, decoding only the value asked for while `data` is still encoded'
+
+    if isinstance(content, MorlockContent) and content.lazy:
+        return seekbinary(memoryview(content.raw), steps)
+
+    # Wiped files have no `data` until they're saved and unloaded
+    if not 'data' in content:
+        return MorlockEmpty
+
+    return getkey(content['data'], steps)
+
+def encodecell(value) -> str:
+    'Render a value for a TSV cell: text as is (tabs, newlines and backslashes escaped), anything else as compact JSON'
+
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def setkey(data: dict, steps: tuple, val, undo: list = None) -> bool:
+    """Set `val` at the compiled `steps` inside `data`, mutating only the
+    containers on the way. Missing containers (or values of the wrong type)
+    are replaced by a dict or a list, and an index equal to the list's length
+    appends. Changes are recorded in `undo` so an out-of-bounds index rolls
+    them back before raising IndexError. Returns whether anything changed.
+    """
+
+    undo = [] if undo is None else undo
+    mark = len(undo)
+    refr = data
+
+    def assign(container, step, value) -> None:
+        if isinstance(step, int) and step == len(container):
+            container.append(value)
+            undo.append(container.pop)
+        elif isinstance(step, int) or step in container:
+            old = container[step]
+            container[step] = value
+            undo.append(lambda: container.__setitem__(step, old))
+        else:
+            container[step] = value
+            undo.append(lambda: container.__delitem__(step))
+
+    try:
+        for i, step in enumerate(steps):
+            # Handling indices out of bound of list
+            if isinstance(step, int):
+                if step > len(refr):
+                    raise IndexError('Given index is out of bounds. Aborting.')
+
+                current = refr[step] if step < len(refr) else MorlockEmpty
+            else:
+                current = refr.get(step, MorlockEmpty)
+
+            # If that's the last step, set the value
+            if i == len(steps) - 1:
+                if current != val:
+                    assign(refr, step, val)
+
+                return len(undo) > mark
+
+            # Going deeper, making sure the next step fits
+            kind = list if isinstance(steps[i + 1], int) else dict
+            if not isinstance(current, kind):
+                current = kind()
+                assign(refr, step, current)
+
+            refr = current
+    except IndexError:
+        rollback(undo, mark)
+        raise
+
+def compilepatch(patch) -> list[tuple]:
+    """Compile a patch into `(op, steps, value)` operations. A JSON object maps
+    `set` keys to values; a list holds RFC 6902 operations (`add`, `remove`,
+    `replace` and `test`) whose JSON Pointer paths are relative to `data`.
+    Raises ValueError with a message for the user if the patch is invalid.
+    """
+
+    if isinstance(patch, dict):
+        return [('set', compilekey(key), val) for key, val in patch.items()]
+
+    if not isinstance(patch, list):
+        raise ValueError('A patch must be a JSON object or a list of operations.')
+
+    ops = []
+    for operation in patch:
+        if not isinstance(operation, dict) or not isinstance(operation.get('path'), str):
+            raise ValueError('Every patch operation needs an `op` and a `path`.')
+
+        op, path = operation.get('op'), operation['path']
+        if op not in ('add', 'remove', 'replace', 'test'):
+            raise ValueError("Unsupported patch operation '{}'.".format(op))
+
+        if op != 'remove' and 'value' not in operation:
+            raise ValueError("Patch operation '{}' needs a `value`.".format(op))
+
+        if path != '' and not path.startswith('/'):
+            raise ValueError("'{}' is not a JSON Pointer.".format(path))
+
+        tokens = [t.replace('~1', '/').replace('~0', '~') for t in path.split('/')[1:]]
+        ops.append((op, tuple(tokens), operation.get('value')))
+
+    return ops
+
+def applypatch(data: dict, ops: list[tuple]) -> bool:
+    """Apply compiled patch operations to `data`, in order. Either every
+    operation applies or, on the first failure, all of them are rolled back
+    and ValueError is raised. Returns whether anything changed.
+    """
+
+    undo = []
+
+    try:
+        for op, steps, val in ops:
+            val = copy.deepcopy(val) if isinstance(val, (dict, list)) else val
+
+            if op == 'set':
+                setkey(data, steps, val, undo)
+                continue
+
+            if steps == ():
+                raise ValueError('The whole of `data` cannot be patched.')
+
+            # Resolving the parent of the target
+            refr = data
+            for token in steps[:-1]:
+                refr = pointerget(refr, token)
+
+            container, token = refr, steps[-1]
+            if isinstance(container, list):
+                index = len(container) if token == '-' and op == 'add' else pointerindex(container, token, op == 'add')
+                exists = index < len(container)
+            elif isinstance(container, dict):
+                index, exists = token, token in container
+            else:
+                raise ValueError("'{}' does not lead to a container.".format('/'.join(steps)))
+
+            if op != 'add' and not exists:
+                raise ValueError("'{}' does not exist.".format('/'.join(steps)))
+
+            if op == 'test':
+                if container[index] != val:
+                    raise ValueError("Test of '{}' failed.".format('/'.join(steps)))
+            elif op == 'remove':
+                old = container.pop(index)
+                undo.append(lambda c=container, i=index, o=old: pointerrestore(c, i, o))
+            elif op == 'add' and isinstance(container, list):
+                container.insert(index, val)
+                undo.append(lambda c=container, i=index: c.pop(i))
+            elif exists and container[index] != val:
+                old = container[index]
+                container[index] = val
+                undo.append(lambda c=container, i=index, o=old: c.__setitem__(i, o))
+            elif not exists:
+                container[index] = val
+                undo.append(lambda c=container, i=index: c.__delitem__(i))
+    except (ValueError, IndexError) as e:
+        rollback(undo)
+        raise ValueError(str(e))
+
+    return len(undo) > 0
+
+def pointerindex(container: list, token: str, append: bool = False) -> int:
+    'Resolve a JSON Pointer token into an index of `container`'
+
+    if not token.isdecimal() or (len(token) > 1 and token.startswith('0')):
+        raise ValueError("'{}' is not a list index.".format(token))
+
+    index = int(token)
+    if index > len(container) or (index == len(container) and not append):
+        raise ValueError('Given index is out of bounds. Aborting.')
+
+    return index
+
+def pointerget(container, token: str):
+    'Step into `container` with a JSON Pointer token'
+
+    if isinstance(container, list):
+        return container[pointerindex(container, token)]
+
+    if isinstance(container, dict) and token in container:
+        return container[token]
+
+    raise ValueError("'{}' does not exist.".format(token))
+
+def pointerrestore(container, index, old) -> None:
+    if isinstance(container, list):
+        container.insert(index, old)
+    else:
+        container[index] = old
+
+def fingerprint(st: os.stat_result) -> tuple[int, int, int]:
+    'Identify a version of a file by its size, modification time and inode'
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+def readfile(path: str, lazy: bool = False, known: bytes = None) -> tuple[os.stat_result, int, int, int, dict, bytes, int]:
+    """Stat a file and decode its header without loading it. Returns
+    `(st, offset, version, flags, content, digest, bytesread)`, content and
+    digest being None when the file has no Morlock content. With `lazy`,
+    the data of binary headers is decoded on first access; a header whose
+    digest is `known` isn't decoded at all (content is None). Raises
+    ValueError on corrupted headers.
+    """
+
+    with STATS.phase('load.read', path) as phase:
+        st = os.stat(path)
+        head, header, bytesread, version, flags = readheader(path, CONTAINERS[MorlockCli.extension(path)])
+        phase.read = bytesread
+
+    if header is None:
+        return st, 0, FRAME_VERSION, 0, None, None, bytesread
+
+    start, end, offset = header
+    if offset is None:
+        raise ValueError('possibly corrupted')
+
+    digest = headerdigest(head[:end])
+    if known is not None and digest == known:
+        return st, offset, version, flags, None, digest, bytesread
+
+    with STATS.phase('load.decode', path):
+        content = decodepayload(head[start:end], flags, lazy) if version else extractjson(head[start:end])
+
+    if content is None or not MorlockCli.isvalid(content):
+        raise ValueError('possibly corrupted')
+
+    return st, offset, version, flags, content, digest, bytesread
+
+def headerdigest(header: bytes) -> bytes:
+    'Hash of a framed header as found on disk, padding left out'
+    return hashlib.blake2b(header, digest_size=16).digest()
+
 class MorlockFile:
-    path: str = None
-    data: str = None
-    wiped: bool = False
-    content: dict = None
-    modified: bool = False
+    """A loaded header. The audio is never kept in memory: only where it
+    starts (`offset`), its `length` and a `stamp` of the file it belongs to,
+    so `save` can reopen the file and make sure it didn't change meanwhile.
+    `digest` is a hash of the header bytes, telling whether a file that
+    changed on disk got a new header or only new audio, and whether edits
+    left the header as it was.
+    """
+
+    __slots__ = ('path', 'offset', 'length', 'stamp', 'digest', 'version', 'codec', 'content', 'registry', '_wiped', '_modified')
 
-    def __init__(self, path: str, data: str, content: dict) -> None:
+    def __init__(self, path: str, offset: int, content: dict, st: os.stat_result = None) -> None:
         self.path = path
-        self.data = data
+        self.offset = offset
         self.content = content
+        self.digest = None
+        self.version = FRAME_VERSION
+        self.codec = 0
+        self.registry = None
+        self._wiped = False
+        self._modified = False
+
+        st = os.stat(path) if st is None else st
+        self.length = st.st_size - offset
+        self.stamp = fingerprint(st)
+
+    # Flags keep the registry's indexes up to date
+    @property
+    def modified(self) -> bool:
+        return self._modified
+
+    @modified.setter
+    def modified(self, value: bool) -> None:
+        self._modified = value
+        if self.registry is not None:
+            self.registry.index(self)
+
+    @property
+    def wiped(self) -> bool:
+        return self._wiped
+
+    @wiped.setter
+    def wiped(self, value: bool) -> None:
+        self._wiped = value
+        if self.registry is not None:
+            self.registry.index(self)
+
+    def snapshot(self) -> tuple[bytes, int]:
+        'Encode the content as it is now: `(payload, codec)`, the payload empty when there is no header to write'
+
+        if not self.content:
+            return b'', self.codec
+
+        with STATS.phase('save.encode', self.path):
+            return encodepayload(self.content, self.codec), self.codec
+
+    def encode(self, padding: int = 0, snapshot: tuple[bytes, int] = None) -> tuple[bytes, int]:
+        """Frame the header the way `write` puts it on disk: padded to fill the
+        old header when it fits in it, followed by `padding` bytes otherwise.
+        Returns the header without its padding and how much padding follows.
+        """
+
+        payload, codec = self.snapshot() if snapshot is None else snapshot
+        if not payload:
+            return b'', 0
+
+        size = FRAME.size + len(payload)
+        pad = self.offset - size if size <= self.offset else padding
+        frame = FRAME.pack(FRAME_MAGIC, FRAME_VERSION, codec, len(payload), zlib.crc32(payload), pad)
+
+        return frame + payload, pad
+
+    def dirty(self) -> bool:
+        'Whether saving would change the file: edits that leave the header byte-identical do not count'
+
+        header, _ = self.encode()
+        if not header:
+            return self.offset > 0
 
-    def gen_bytes(self) -> bytes:
-        if self.content == {}:
-            data = ''
+        return self.digest != headerdigest(header)
+
+    def write(self, padding: int = 0, snapshot: tuple[bytes, int] = None) -> bool:
+        """Write the header to disk, or the `snapshot` of it taken earlier;
+        `padding` is reserved when the whole file has to be rewritten.
+        Returns False, writing nothing, when the header on disk is already
+        byte-identical.
+        """
+
+        # Offsets are only valid for the file as it was loaded
+        if fingerprint(os.stat(self.path)) != self.stamp:
+            raise OSError('file changed on disk since it was loaded; `reload` it first')
+
+        # Encoding the payload once, framed for where it's going
+        header, pad = self.encode(padding, snapshot)
+        digest = headerdigest(header) if header else None
+
+        if digest == self.digest and (header or self.offset == 0):
+            STATS.add('save.skipped')
+            return False
+
+        newcontent = header + bytes(pad)
+
+        # If the new header fits in the old one, only the header is overwritten
+        if header and len(newcontent) == self.offset:
+            with STATS.phase('save.inplace', self.path) as phase, open(self.path, 'r+b') as f:
+                f.write(newcontent)
+                f.flush()
+                os.fsync(f.fileno())
+                phase.written = len(newcontent)
         else:
-            content = json.dumps(self.content, indent=None, separators=(',', ':'))
-            data = OPEN_TAG + content + CLOSE_TAG
+            # Streaming the audio content after the new header
+            with STATS.phase('save.rewrite', self.path) as phase:
+                rewritefile(self.path, newcontent, self.offset)
+                phase.read = self.length
+                phase.written = len(newcontent) + self.length
+
+        # The file now matches memory, so there's nothing to reload
+        self.offset = len(newcontent)
+        self.version = FRAME_VERSION
+        self.stamp = fingerprint(os.stat(self.path))
+        self.digest = digest
 
-        return data.encode('utf-8')
+        return True
 
-class MorlockEmpty:
-    pass
+    def verify(self) -> bool:
+        'Re-read only the header from disk and check it matches memory'
+
+        container = CONTAINERS[MorlockCli.extension(self.path)]
+        head, header, _, version, flags = readheader(self.path, container)
+
+        if header is None or header[2] != self.offset or version != self.version or flags != self.codec:
+            return False
+
+        if os.path.getsize(self.path) != self.offset + self.length:
+            return False
+
+        start, end, _ = header
+        return decodepayload(head[start:end], flags) == self.content
 
-class MorlockCli(cmd.Cmd):
+class MorlockWriter:
+    """Writes saved files to disk on a background thread. A file saved again
+    while it waits is written once, with its latest snapshot. Every file is
+    written at most `delay` seconds after it was first queued, and `put`
+    blocks while `depth` files are waiting.
+    """
+
+    def __init__(self, delay: float = 0.5, depth: int = 1024) -> None:
+        import threading
+
+        self.delay = delay
+        self.depth = depth
+
+        # Waiting files in the order they were first queued, with when they're due
+        self.pending: dict[MorlockFile, tuple[float, tuple[bytes, int], int]] = {}
+        self.busy = None
+        self.flushing = 0
+        self.written = 0
+        self.errors: list[tuple[MorlockFile, Exception]] = []
+        self.cond = threading.Condition()
+
+        self.thread = threading.Thread(target=self.run, name='morlock-writer', daemon=True)
+        self.thread.start()
+
+    def put(self, morlockfile: MorlockFile, padding: int = 0) -> None:
+        'Queue `morlockfile` to be written as it is now'
+
+        # Snapshotting here, so later changes wait for the next `save`
+        snapshot = morlockfile.snapshot()
+
+        with self.cond:
+            while len(self.pending) >= self.depth and not morlockfile in self.pending:
+                self.cond.wait()
+
+            if morlockfile in self.pending:
+                due = self.pending[morlockfile][0]
+                STATS.add('save.coalesced')
+            else:
+                due = time.monotonic() + self.delay
+                STATS.add('save.queued')
+
+            self.pending[morlockfile] = (due, snapshot, padding)
+            self.cond.notify_all()
+
+    def wait(self) -> None:
+        'Write every waiting file now and return once they are all on disk'
+
+        with self.cond:
+            self.flushing += 1
+            self.cond.notify_all()
+
+            while self.pending or self.busy is not None:
+                self.cond.wait()
+
+            self.flushing -= 1
+
+    def take(self) -> tuple[int, list[tuple[MorlockFile, Exception]]]:
+        'Return how many files were written and which failed since the last call'
+
+        with self.cond:
+            written, errors = self.written, self.errors
+            self.written, self.errors = 0, []
+
+        return written, errors
+
+    def run(self) -> None:
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+
+                morlockfile, (due, snapshot, padding) = next(iter(self.pending.items()))
+                wait = due - time.monotonic()
+                if wait > 0 and not self.flushing:
+                    self.cond.wait(wait)
+                    continue
+
+                del self.pending[morlockfile]
+                self.busy = morlockfile
+                self.cond.notify_all()
+
+            # Anything going wrong is kept for `flush` to report; the thread must go on
+            try:
+                morlockfile.write(padding, snapshot)
+                error = None
+            except Exception as e:
+                error = e
+
+            with self.cond:
+                self.busy = None
+                if error is None:
+                    self.written += 1
+                else:
+                    self.errors.append((morlockfile, error))
+                self.cond.notify_all()
+
+class MorlockRegistry:
+    'Loaded MorlockFiles keyed by normalized absolute path, indexing modified and wiped files and the active one'
+
+    def __init__(self) -> None:
+        self.files: dict[str, MorlockFile] = {}
+        self.modified: set[MorlockFile] = set()
+        self.wiped: set[MorlockFile] = set()
+        self.active: MorlockFile = None
+
+    @staticmethod
+    def key(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    def add(self, morlockfile: MorlockFile) -> None:
+        self.files[MorlockRegistry.key(morlockfile.path)] = morlockfile
+        morlockfile.registry = self
+        self.index(morlockfile)
+
+    def remove(self, morlockfile: MorlockFile) -> None:
+        del self.files[MorlockRegistry.key(morlockfile.path)]
+        morlockfile.registry = None
+        self.modified.discard(morlockfile)
+        self.wiped.discard(morlockfile)
+
+        if self.active is morlockfile:
+            self.active = None
+
+    def get(self, path: str) -> MorlockFile:
+        return self.files.get(MorlockRegistry.key(path))
+
+    def index(self, morlockfile: MorlockFile) -> None:
+        'Update the secondary indexes after a flag of `morlockfile` changed'
+
+        for flag, indexed in ((morlockfile.modified, self.modified), (morlockfile.wiped, self.wiped)):
+            if flag:
+                indexed.add(morlockfile)
+            else:
+                indexed.discard(morlockfile)
+
+    def __contains__(self, path: str) -> bool:
+        return MorlockRegistry.key(path) in self.files
+
+    def __iter__(self):
+        return iter(self.files.values())
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+class MorlockCli:
     intro = 'Welcome to morlock.\nType help or ? to list commands.\n'
     prompt = 'morlock> '
 
-    loadedfiles: list[MorlockFile] = []
-    activefile: MorlockFile = None
+    # Whether to fall back to asking the user when `answers` has none preset
+    interactive: bool = True
+
+    padding: int = 0
+
+    # bcrypt work factor for `lock`, and for how long a verified password is remembered
+    cost: int = 12
+    unlockttl: float = 300
+
+    def __init__(self) -> None:
+        self.loadedfiles = MorlockRegistry()
+        # Preset answers to questions (e.g. `password`)
+        self.answers: dict[str, str] = {}
+        self.unlocked: dict[str, float] = {}
+        self.catalog = None
+        self.writer = None
+
+    @property
+    def activefile(self) -> MorlockFile:
+        return self.loadedfiles.active
+
+    @activefile.setter
+    def activefile(self, morlockfile: MorlockFile) -> None:
+        self.loadedfiles.active = morlockfile
 
     def do_load(self, paths: str) -> None:
-        'Load given file(s)'
+        'Load given file(s); directories (recursively with `-r`) and globs are expanded'
+
+        self.settle()
+        paths = self.expandpaths(shlex.split(paths))
+        msgs = [None] * len(paths)
+        pending = []
+        seen = set()
 
-        for path in shlex.split(paths):
+        for i, path in enumerate(paths):
             # If to-be-active file is already loaded
-            if self.findmorlockfile({'path': path}) is not None:
-                msg = "'{}' is already loaded. Maybe try `switch`?".format(path)
-                print(msg)
-                continue
+            if path in self.loadedfiles or MorlockRegistry.key(path) in seen:
+                msgs[i] = "'{}' is already loaded. Maybe try `switch`?".format(path)
 
             # If the given file does not exist
-            if not os.path.isfile(path):
-                msg = "'{}' not found.".format(path)
-                print(msg)
-                continue
+            elif not os.path.isfile(path):
+                msgs[i] = "'{}' not found.".format(path)
 
             # If the file's extension isn't supported
-            ext = os.path.splitext(path)[1].replace('.', '').lower()
-            if not ext in EXTENSIONS:
-                msg = "Extension '{}' is not supported.".format(ext)
-                print(msg)
-                continue
+            elif not MorlockCli.extension(path) in CONTAINERS:
+                msgs[i] = "Extension '{}' is not supported.".format(MorlockCli.extension(path))
 
-            with open(path, 'rb') as f:
-                byte = f.read()
-                
-            close_tag = CLOSE_TAG.encode('utf-8')
-            open_tag = OPEN_TAG.encode('utf-8')
-            sigs = EXTENSIONS.get(ext)
-            wasmodified = False
-            content = []
-
-            # If there's no Morlock content in the file
-            if not open_tag in byte or not close_tag in byte:
-                msg = "Empty file detected. Loading defaults..."
-                print(msg)
-                default = copy.deepcopy(DEFAULT)
-                msg = "Enter name: "
-                name = input(msg)
-                default['name'] = name
-                msg = "Should the file be password-protected (y/n)? "
-                isprotected = input(msg)
-                isprotected = (isprotected.lower() == 'y')
-                wasmodified = True
-                content = OPEN_TAG + json.dumps(default) + CLOSE_TAG
             else:
-                sig = next(filter(lambda s: s in byte, sigs), None)
-                if sig is None:
-                    msg = "'{}' is possibly corrupted.".format(path)
-                    print(msg)
-                    continue
+                pending.append(i)
 
-                # Reading until the start of audio content
-                while not byte.startswith(sig):
-                    content.append(byte[0])
-                    byte = byte[1:]
+            seen.add(MorlockRegistry.key(path))
 
-                # Turning array of ints into string with the file's content
-                content = ''.join(map(chr, content))
-                isprotected = False
-                
-            # Saving the rest of the file
-            data = byte
+        # Reading headers concurrently; everything else happens in input order
+        # Files are stamped before being read, so a change while reading is caught on `save`
+        def read(i: int):
+            try:
+                return readfile(paths[i], lazy=True)
+            except (OSError, ValueError) as e:
+                return e
 
-            # Getting `morlock` content inside of the file's head
-            while not content.startswith(OPEN_TAG):
-                content = content[1:]
+        results = dict(zip(pending, mapordered(read, pending)))
+        loaded = {}
+        locked = []
 
-            while not content.endswith(CLOSE_TAG):
-                content = content[:-1]
+        for i in pending:
+            path = paths[i]
+            result = results.pop(i)
 
-            # Removing `morlock` tags
-            content = content.replace(OPEN_TAG, '').replace(CLOSE_TAG, '')
-
-            # Extracting JSON content
-            while not MorlockCli.isjson(content) and content != '':
-                content = content[1:]
+            if isinstance(result, OSError):
+                msgs[i] = "Could not read '{}': {}".format(path, result.strerror)
+                continue
 
             # If `morlock` content isn't JSON
-            if not MorlockCli.isvalid(content):
-                msg = "'{}' is possibly corrupted.".format(path)
-                print(msg)
+            if isinstance(result, ValueError):
+                msgs[i] = "'{}' is possibly corrupted.".format(path)
                 continue
 
-            content = json.loads(content)
+            st, offset, version, flags, content, digest, bytesread = result
+            isprotected = False
+
+            # If there's no Morlock content in the file, the whole file is audio content
+            if content is None:
+                msg = "Empty file detected. Loading defaults..."
+                print(msg)
+                content = copy.deepcopy(DEFAULT)
+                msg = "Enter name: "
+                name = self.ask(msg, 'name')
+                content['name'] = name
+                msg = "Should the file be password-protected (y/n)? "
+                isprotected = self.ask(msg, 'protect', 'n')
+                isprotected = (isprotected.lower() == 'y')
+
+            # Remembering where the audio starts; it's only read back on `save`
+            morlockfile = MorlockFile(path, offset, content, st)
+            morlockfile.modified = digest is None
+            morlockfile.version = version
+            morlockfile.codec = flags
+            morlockfile.digest = digest
+            loaded[i] = (morlockfile, bytesread, isprotected)
 
             # If file is encrypted
             if content['password'] is not None:
-                password = content['password']
-                match = MorlockCli.passwordcheck(password, path)
-                if not match:
-                    msg = 'Incorrect password entered.'
-                    print(msg)
-                    continue
-            else:
-                password = None
+                locked.append(i)
+
+        # Checking passwords of encrypted files all at once
+        checks = [(loaded[i][0].content['password'], paths[i]) for i in locked]
+        for i, match in zip(locked, self.passwordchecks(checks)):
+            if not match:
+                msgs[i] = 'Incorrect password entered.'
+                del loaded[i]
+
+        protect = []
+        for i, msg in enumerate(msgs):
+            if i in loaded:
+                morlockfile, bytesread, isprotected = loaded[i]
+                msg = "'{}' loaded successfully ({} bytes read).".format(morlockfile.path, bytesread)
+                self.loadedfiles.add(morlockfile)
+
+                if isprotected:
+                    protect.append(morlockfile.path)
 
-            msg = "'{}' loaded successfully.".format(path)
-            morlockfile = MorlockFile(path, data, content)
-            self.loadedfiles.append(morlockfile)
-            morlockfile.modified = wasmodified
             print(msg)
 
-            if isprotected:
-                self.do_lock(morlockfile.path)
+        if protect:
+            self.do_lock(' '.join(map(shlex.quote, protect)))
 
     def do_unload(self, paths: str) -> None:
         'Unload given MorlockFile(s)'
 
         def unload(path: str) -> None:
             # Finding file with given path            
-            morlockfile = self.findmorlockfile({'path': path})
+            morlockfile = self.loadedfiles.get(path)
 
             # If no file's found, maybe it wasn't loaded.
             if morlockfile is None:
@@ -172,10 +1670,10 @@ class MorlockCli(cmd.Cmd):
             # If the file to be unloaded was modified and not saved
             if morlockfile.modified:
                 msg = "'{}' was modified. Do you wish to close it and discard changes (y/n)? ".format(path)
-                discard = input(msg)
+                discard = self.ask(msg, 'discard', 'n')
 
                 while discard.lower() not in ['y', 'n']:
-                    discard = input(msg)
+                    discard = self.ask(msg, 'discard', 'n')
 
                 if discard == 'n':
                     return
@@ -189,7 +1687,7 @@ class MorlockCli(cmd.Cmd):
             print(msg)
 
         if paths != '':
-            for path in shlex.split(paths):
+            for path in self.expandpaths(shlex.split(paths)):
                 unload(path)
         elif self.activefile is not None:
             unload(self.activefile.path)
@@ -198,27 +1696,220 @@ class MorlockCli(cmd.Cmd):
             print(msg)
 
     def do_reload(self, paths: str) -> None:
-        'Shortcut to `unload [FILE]; load [FILE]'
-
-        def reload(path: str) -> None:
-            self.do_unload(path)
-            self.do_load(path)
+        """Re-read given file(s) - `all` loaded ones or the active one - from disk.
+        Loaded files are only read again when their size, mtime or inode
+        changed, or to drop unsaved changes; others given get loaded.
+        """
 
-        if paths != '':
-            for path in shlex.split(paths):
-                reload(path)
+        args = shlex.split(paths)
+        if args == ['all']:
+            morlockfiles, unloaded = list(self.loadedfiles), []
+        elif args:
+            paths = self.expandpaths(args)
+            morlockfiles = [self.loadedfiles.get(path) for path in paths if path in self.loadedfiles]
+            unloaded = [path for path in paths if not path in self.loadedfiles]
         elif self.activefile is not None:
-            reload(self.activefile.path)
+            morlockfiles, unloaded = [self.activefile], []
         else:
             msg = 'There were no given files to be reloaded.'
             print(msg)
+            return
+
+        # Dropping unsaved changes means reading the header again even if the file didn't change
+        force = set()
+        for morlockfile in morlockfiles:
+            if morlockfile.modified or morlockfile.wiped:
+                msg = "'{}' was modified. Do you wish to discard changes and reload it (y/n)? ".format(morlockfile.path)
+                discard = self.ask(msg, 'discard', 'n')
+
+                while discard.lower() not in ['y', 'n']:
+                    discard = self.ask(msg, 'discard', 'n')
+
+                if discard.lower() == 'y':
+                    force.add(morlockfile)
+
+        read = self.refresh(morlockfiles, force)
+        msg = '{} loaded file(s) checked, {} read again.'.format(len(morlockfiles), read)
+        print(msg)
+
+        if unloaded:
+            self.do_load(' '.join(map(shlex.quote, unloaded)))
+
+    def refresh(self, morlockfiles: list[MorlockFile], force: set = frozenset(), seen: dict = None) -> int:
+        """Re-read the headers of loaded files whose stamp changed, and of those
+        in `force`, dropping their unsaved changes. A header that is byte for
+        byte the same only renews the stamp, keeping unsaved changes; a new one
+        replaces the content of files without any. Stamps in `seen` are
+        skipped, and stamps of conflicting files get added to it. Returns how
+        many headers were read.
+        """
+
+        self.settle()
+        stale = []
+        for morlockfile in morlockfiles:
+            try:
+                st = os.stat(morlockfile.path)
+            except OSError:
+                st = None
+
+            stamp = st and fingerprint(st)
+            if morlockfile in force or stamp != morlockfile.stamp and (seen is None or not morlockfile in seen or seen[morlockfile] != stamp):
+                stale.append((morlockfile, st))
+
+        # Headers that didn't change aren't decoded again
+        def read(item: tuple):
+            morlockfile, st = item
+            if st is None:
+                return None
+
+            try:
+                return readfile(morlockfile.path, lazy=True, known=None if morlockfile in force else morlockfile.digest)
+            except (OSError, ValueError) as e:
+                return e
+
+        results = mapordered(read, stale)
+        updates = []
+        reload = []
+
+        for (morlockfile, st), result in zip(stale, results):
+            path = morlockfile.path
+
+            # Only the audio, or just the mtime, changed
+            if isinstance(result, tuple) and not morlockfile in force and result[5] == morlockfile.digest and result[1] == morlockfile.offset:
+                morlockfile.stamp = fingerprint(result[0])
+                morlockfile.length = result[0].st_size - result[1]
+                continue
+
+            # Whatever happened on disk, unsaved changes are only dropped when asked to
+            if (morlockfile.modified or morlockfile.wiped) and not morlockfile in force:
+                msg = "'{}' changed on disk but has unsaved changes; `reload` it to drop them.".format(path)
+                print(msg)
+
+                if seen is not None:
+                    seen[morlockfile] = st and fingerprint(st)
+                continue
+
+            if result is None or isinstance(result, OSError):
+                msg = "'{}' can no longer be read; unloading it.".format(path)
+                print(msg)
+                self.loadedfiles.remove(morlockfile)
+                continue
+
+            # Files that lost their header or got a broken one go through `load` again
+            if isinstance(result, ValueError) or result[4] is None:
+                reload.append(morlockfile)
+                continue
+
+            updates.append((morlockfile, *result))
+
+        # Files locked with a different password need it again
+        locked = [update for update in updates if update[5]['password'] not in (None, update[0].content['password'])]
+        matches = self.passwordchecks([(update[5]['password'], update[0].path) for update in locked])
+        denied = {update[0] for update, match in zip(locked, matches) if not match}
+
+        for morlockfile, st, offset, version, flags, content, digest, bytesread in updates:
+            if morlockfile in denied:
+                msg = "Incorrect password entered; unloading '{}'.".format(morlockfile.path)
+                print(msg)
+                self.loadedfiles.remove(morlockfile)
+                continue
+
+            morlockfile.content = content
+            morlockfile.offset = offset
+            morlockfile.length = st.st_size - offset
+            morlockfile.stamp = fingerprint(st)
+            morlockfile.digest = digest
+            morlockfile.version = version
+            morlockfile.codec = flags
+            morlockfile.modified = False
+            morlockfile.wiped = False
+
+            msg = "'{}' reloaded ({} bytes read).".format(morlockfile.path, bytesread)
+            print(msg)
+
+        if reload:
+            for morlockfile in reload:
+                self.loadedfiles.remove(morlockfile)
+
+            self.do_load(' '.join(shlex.quote(morlockfile.path) for morlockfile in reload))
+
+        return sum(1 for _, st in stale if st is not None)
+
+    def do_watch(self, args: str) -> None:
+        """Reload loaded files as other programs change them, until interrupted (Ctrl-C) or for SECONDS.
+        Syntax: `watch [--poll] [SECONDS]`
+        Changes are picked up through inotify where available, otherwise (or
+        with `--poll`) by checking every loaded file's stat each second.
+        """
+
+        args = shlex.split(args)
+        poll = '--poll' in args
+        args = [arg for arg in args if arg != '--poll']
+
+        try:
+            seconds = float(args[0]) if args else None
+        except ValueError:
+            seconds = -1
+
+        if len(args) > 1 or seconds is not None and not seconds >= 0:
+            msg = 'Syntax: `watch [--poll] [SECONDS]`'
+            print(msg)
+            return
+
+        from watch import Inotify
+
+        inotify = None
+        if not poll:
+            try:
+                inotify = Inotify()
+            except OSError:
+                msg = 'inotify is not available; polling instead.'
+                print(msg)
+
+        deadline = None if seconds is None else time.monotonic() + seconds
+        directories = set()
+        seen = {}
+
+        msg = 'Watching {} loaded file(s). Press Ctrl-C to stop.'.format(len(self.loadedfiles))
+        print(msg)
+
+        try:
+            # Catching up with changes made since the files were loaded
+            changed = list(self.loadedfiles)
+
+            while True:
+                if changed:
+                    self.refresh(changed, seen=seen)
+
+                timeout = 1.0 if deadline is None else min(1.0, deadline - time.monotonic())
+                if timeout <= 0:
+                    break
+
+                files = {MorlockRegistry.key(morlockfile.path): morlockfile for morlockfile in self.loadedfiles}
+                if inotify is None:
+                    time.sleep(timeout)
+                    changed = list(files.values())
+                    continue
+
+                # Watching directories, as saving with a rename replaces the file itself
+                for directory in {os.path.dirname(key) for key in files} - directories:
+                    inotify.add(directory)
+                    directories.add(directory)
+
+                events = inotify.read(timeout)
+                changed = list(files.values()) if events is None else [files[key] for key in events if key in files]
+        except KeyboardInterrupt:
+            print(sep='')
+        finally:
+            if inotify is not None:
+                inotify.close()
 
     def do_list(self, paths: str) -> None:
         "Print data that's saved on file(s) - given or active"
 
         def llist(path: str) -> None:
             # Finding file with given path
-            morlockfile = self.findmorlockfile({'path': path})
+            morlockfile = self.loadedfiles.get(path)
             
             # If no file's found
             if morlockfile is None:
@@ -252,310 +1943,644 @@ class MorlockCli(cmd.Cmd):
         # If `key`, `val` and files are given
         # E.g `set social.instagram apple file.mp3`
         if len(args) >= 3:
-            key, val, paths = args[0], args[1], args[2:]
+            key, val, paths = args[0], args[1], self.expandpaths(args[2:])
         elif len(args) == 2:
             if self.activefile is None:
                 msg = "No file is active. First, run `activate [FILE]`"
                 print(msg)
-                return
+                return
+
+            key, val, paths = args[0], args[1], [self.activefile.path]
+        else:
+            msg = 'A key, a value and a file (if none is active) must be provided.'
+            print(msg)
+            return
+
+        # Compiling the key once for every file
+        with STATS.phase('set.parse'):
+            try:
+                steps = compilekey(key)
+            except ValueError as e:
+                print(e)
+                return
+
+            if MorlockCli.isjson(val):
+                val = json.loads(val)
+
+        for path in paths:
+            morlockfile = self.loadedfiles.get(path)
+
+            if morlockfile is None:
+                msg = "'{}' is not loaded; skipping...".format(path)
+                print(msg)
+                continue
+
+            # Files must not share a mutable value
+            value = copy.deepcopy(val) if isinstance(val, (dict, list)) else val
+
+            try:
+                with STATS.phase('set.apply', path):
+                    changed = setkey(morlockfile.content['data'], steps, value)
+            except IndexError as e:
+                print(e)
+                return
+
+            if changed:
+                morlockfile.modified = True
+
+    def do_get(self, args: str) -> None:
+        """Print one value from many files, one line per file.
+        Syntax: `get [--tsv] key [FILE-1 ... FILE-N | all]`
+        `key` uses the `set` syntax. Lines are JSON (`{"path": ..., "value": ...}`)
+        or, with `--tsv`, the path and the value separated by a tab. Files
+        without the key are left out.
+        """
+
+        args = shlex.split(args)
+        tsv = '--tsv' in args
+        args = [arg for arg in args if arg != '--tsv']
+
+        if not args:
+            msg = 'A key must be provided.'
+            print(msg)
+            return
+
+        try:
+            steps = compilekey(args[0])
+        except ValueError as e:
+            print(e)
+            return
+
+        for morlockfile in self.targets(args[1:]):
+            value = lookup(morlockfile.content, steps)
+            if value is MorlockEmpty:
+                continue
+
+            if tsv:
+                print(encodecell(morlockfile.path), encodecell(value), sep='\t')
+            else:
+                print(json.dumps({'path': morlockfile.path, 'value': value}, ensure_ascii=False, separators=(',', ':')))
+
+    def do_query(self, args: str) -> None:
+        """Print several values from many files, one line per file.
+        Syntax: `query [--tsv] key-1,key-2,...,key-N [FILE-1 ... FILE-N | all]`
+        Keys use the `set` syntax. Lines are JSON objects holding the path and
+        the keys a file has or, with `--tsv`, a header line followed by one
+        tab-separated row per file, missing values left empty.
+        """
+
+        args = shlex.split(args)
+        tsv = '--tsv' in args
+        args = [arg for arg in args if arg != '--tsv']
+
+        if not args:
+            msg = 'At least one key must be provided.'
+            print(msg)
+            return
+
+        keys = args[0].split(',')
+        try:
+            steps = [compilekey(key) for key in keys]
+        except ValueError as e:
+            print(e)
+            return
+
+        if tsv:
+            print('path', *map(encodecell, keys), sep='\t')
+
+        for morlockfile in self.targets(args[1:]):
+            values = [lookup(morlockfile.content, s) for s in steps]
+
+            if tsv:
+                cells = ['' if value is MorlockEmpty else encodecell(value) for value in values]
+                print(encodecell(morlockfile.path), *cells, sep='\t')
+            else:
+                row = {'path': morlockfile.path}
+                row.update((key, value) for key, value in zip(keys, values) if value is not MorlockEmpty)
+                print(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+
+    def targets(self, paths: list[str]):
+        """Yield the loaded files for given paths, every loaded file for `all`
+        or the active file for none. Notices go to stderr so they never mix
+        with piped output.
+        """
+
+        if paths == ['all']:
+            yield from list(self.loadedfiles)
+            return
+
+        if not paths:
+            if self.activefile is None:
+                msg = "There's no active file and zero files were given."
+                print(msg, file=sys.stderr)
+                return
+
+            paths = [self.activefile.path]
+
+        for path in self.expandpaths(paths):
+            morlockfile = self.loadedfiles.get(path)
+
+            if morlockfile is None:
+                msg = "'{}' is not loaded; skipping...".format(path)
+                print(msg, file=sys.stderr)
+                continue
+
+            yield morlockfile
+
+    def do_patch(self, args: str) -> None:
+        """Apply many changes to file(s) at once.
+        Syntax: `patch PATCH [FILE-1 FILE-2 ... FILE-N]`
+        `PATCH` is JSON, or `@path` to read it from a file. It's either an
+        object mapping `set` keys to values (e.g. `{"artist.name": "X", "tags[0]": "a"}`)
+        or a list of RFC 6902 operations (`add`, `remove`, `replace`, `test`)
+        whose paths point inside `data` (e.g. `[{"op": "remove", "path": "/tags/0"}]`).
+        Either every change applies to a file or none does.
+        """
+
+        args = shlex.split(args)
+
+        if len(args) >= 2:
+            patch, paths = args[0], self.expandpaths(args[1:])
+        elif len(args) == 1:
+            if self.activefile is None:
+                msg = "No file is active. First, run `activate [FILE]`"
+                print(msg)
+                return
+
+            patch, paths = args[0], [self.activefile.path]
+        else:
+            msg = 'A patch and a file (if none is active) must be provided.'
+            print(msg)
+            return
+
+        # Parsing and compiling the patch once for every file
+        try:
+            if patch.startswith('@'):
+                with open(patch[1:], 'r', encoding='utf-8') as f:
+                    patch = f.read()
+
+            ops = compilepatch(json.loads(patch))
+        except OSError as e:
+            msg = "Could not read patch: {}".format(e)
+            print(msg)
+            return
+        except ValueError as e:
+            msg = "Invalid patch: {}".format(e)
+            print(msg)
+            return
+
+        for path in paths:
+            morlockfile = self.loadedfiles.get(path)
+
+            if morlockfile is None:
+                msg = "'{}' is not loaded; skipping...".format(path)
+                print(msg)
+                continue
+
+            try:
+                changed = applypatch(morlockfile.content['data'], ops)
+            except ValueError as e:
+                msg = "'{}' was not patched: {}".format(path, e)
+                print(msg)
+                continue
+
+            if changed:
+                morlockfile.modified = True
+
+    def do_activate(self, path: str) -> None:
+        'Activate given MorlockFile'
+
+        args = shlex.split(path)
+        if len(args) != 1:
+            msg = 'A single file must be provided.'
+            print(msg)
+            return
+
+        # Finding file with given path
+        path = args[0]
+        morlockfile = self.loadedfiles.get(path)
+        if morlockfile is None:
+            msg = "'{}' is not currently loaded.".format(path)
+            print(msg)
+            return
+
+        if self.activefile is None:
+            self.activefile = morlockfile
+            self.prompt = 'morlock({})> '.format(path)
+            msg = "'{}' activated successfully.".format(path)
+            print(msg)
+        else:
+            path = self.activefile.path
+            msg = "'{}' is currently active.".format(path)
+
+    def do_deactivate(self, _: str=None) -> None:
+        'Deactivate currently active MorlockFile'
+
+        # If there's no active file
+        if self.activefile is None:
+            msg = "There's no currently active file."
+            print(msg)
+            return
+
+        self.activefile = None
+        self.prompt = 'morlock> '
+
+    def do_switch(self, path: str) -> None:
+        '`switch [FILE]` is a shortcut for `deactivate; activate [FILE]`'
+
+        args = shlex.split(path)
+        if len(args) != 1:
+            msg = 'A single file must be provided.'
+            print(msg)
+            return
+
+        path = args[0]
+        morlockfile = self.loadedfiles.get(path)
+
+        # If to-be-active file is not loaded
+        if morlockfile is None:
+            msg = "'{}' is not loaded.".format(path)
+            print(msg)
+        else:
+            if self.activefile is not None:
+                self.do_deactivate()
+            
+            self.do_activate(shlex.quote(path))
+
+    def do_save(self, paths: str) -> None:
+        'Save given MorlockFile(s) (e.g.: `save`, `save file1 file2 file3`); `--verify` re-reads the written headers'
+
+        args = shlex.split(paths)
+        verify = '--verify' in args
+        args = [arg for arg in args if arg != '--verify']
+
+        if args:
+            paths = self.expandpaths(args)
+        elif self.activefile is not None:
+            paths = [self.activefile.path]
+        else:
+            msg = "There's no active file and zero files were given to be saved."
+            print(msg)
+            return
+
+        msgs = [None] * len(paths)
+        pending = {}
+
+        for i, path in enumerate(paths):
+            # Finding given file
+            morlockfile = self.loadedfiles.get(path)
+            if morlockfile is None:
+                msgs[i] = "File '{}' not found.".format(path)
+            elif not morlockfile.modified and not morlockfile.wiped:
+                msgs[i] = "File '{}' was not modified; skipping.".format(path)
+            elif morlockfile not in pending:
+                pending[morlockfile] = i
+
+        # Writing files concurrently, keeping any error for its own file
+        def write(morlockfile: MorlockFile):
+            try:
+                written = morlockfile.write(self.padding)
+
+                if verify and not morlockfile.wiped:
+                    with STATS.phase('save.verify', morlockfile.path):
+                        if not morlockfile.verify():
+                            return ValueError('header on disk does not match')
+            except OSError as e:
+                return e
+
+            return written
+
+        # In write-back mode files are only queued; `flush` tells how writing them went
+        queued = self.writer is not None and not verify
+        if queued:
+            for morlockfile in pending:
+                self.writer.put(morlockfile, self.padding)
+            results = [None] * len(pending)
+        else:
+            # Older queued snapshots must land before, not over, this write
+            self.settle()
+            results = mapordered(write, list(pending))
+
+        wiped = []
+
+        for (morlockfile, i), result in zip(pending.items(), results):
+            if queued:
+                msgs[i] = "'{}' queued to be saved.".format(morlockfile.path)
+                morlockfile.modified = False
+                if morlockfile.wiped:
+                    morlockfile.wiped = False
+                    wiped.append(morlockfile.path)
+            elif isinstance(result, Exception):
+                msgs[i] = "Could not save '{}': {}".format(morlockfile.path, result)
+            elif not result and not morlockfile.wiped:
+                morlockfile.modified = False
+                msgs[i] = "'{}' is unchanged on disk; nothing to write.".format(morlockfile.path)
+            elif morlockfile.wiped:
+                morlockfile.wiped = False
+                msgs[i] = "'{}' saved successfully. Unloading file...".format(morlockfile.path)
+                wiped.append(morlockfile.path)
+            else:
+                morlockfile.modified = False
+                msgs[i] = "'{}' saved successfully{}.".format(morlockfile.path, ' and verified' if verify else '')
+
+        for msg in msgs:
+            if msg is not None:
+                print(msg)
+
+        # Wiped files have no Morlock content left to keep loaded
+        if wiped:
+            self.do_unload(' '.join(map(shlex.quote, wiped)))
+
+    def do_migrate(self, paths: str) -> None:
+        'Rewrite given MorlockFile(s) that still use tag-delimited headers with the current header frame'
+
+        def migrate(path: str) -> None:
+            morlockfile = self.loadedfiles.get(path)
+            if morlockfile is None:
+                msg = "'{}' is not currently loaded.".format(path)
+                print(msg)
+                return
+
+            if morlockfile.version == FRAME_VERSION:
+                msg = "'{}' already uses the current header format.".format(path)
+                print(msg)
+                return
+
+            morlockfile.modified = True
+            self.do_save(shlex.quote(path))
+
+        if paths != '':
+            for path in shlex.split(paths):
+                migrate(path)
+        elif self.activefile is not None:
+            migrate(self.activefile.path)
+        else:
+            msg = "There's no active file and zero files were given to be migrated."
+            print(msg)
+
+    def do_padding(self, size: str) -> None:
+        'Show or set how many bytes are reserved after the header when a file is fully rewritten (e.g.: `padding 4096`)'
+
+        if size == '':
+            msg = '{} bytes are reserved after the header on save.'.format(self.padding)
+            print(msg)
+            return
+
+        if not size.isdigit():
+            msg = 'Padding must be a non-negative number of bytes.'
+            print(msg)
+            return
+
+        self.padding = int(size)
+        msg = 'Headers will reserve {} bytes on save.'.format(self.padding)
+        print(msg)
+
+    def do_codec(self, args: str) -> None:
+        """Show or set how the header of file(s) - given or active - is encoded.
+        Syntax: `codec [json|binary|json+zlib|binary+zlib] [FILE-1 ... FILE-N]`
+        The new codec is used on the next `save`. Only binary headers are
+        decoded lazily: `load` decodes `data` of json headers (the default)
+        in full, so large headers need `codec binary` for `load` and `get`
+        to decode just what they read. `set` decodes all of `data` either way.
+        """
+
+        args = shlex.split(args)
+        codec = args.pop(0) if args and args[0] in CODECS else None
+        names = {flags: name for name, flags in CODECS.items()}
+
+        for morlockfile in self.targets(args):
+            if codec is None:
+                msg = "'{}' uses {}.".format(morlockfile.path, names.get(morlockfile.codec, 'an unknown codec'))
+                print(msg)
+                continue
 
-            key, val, paths = args[0], args[1], [self.activefile.path]
-        else:
-            msg = 'A key, a value and a file (if none is active) must be provided.'
+            if morlockfile.codec != CODECS[codec]:
+                morlockfile.codec = CODECS[codec]
+                morlockfile.modified = True
+
+            msg = "'{}' will be saved with {}.".format(morlockfile.path, codec)
             print(msg)
-            return
 
-        # Checking for forbidden characters
-        if len(re.findall(r"[^A-z\d.\[\]]", key)) > 0:
-            msg = 'Forbidden characters found in given key. See `help set`'
+    def do_cost(self, cost: str) -> None:
+        'Show or set the bcrypt work factor `lock` hashes new passwords with (4 to 31; e.g.: `cost 10`)'
+
+        if cost == '':
+            msg = 'New passwords are hashed with a work factor of {}.'.format(self.cost)
             print(msg)
             return
 
-        if MorlockCli.isjson(val):
-            val = json.loads(val)
+        if not cost.isdecimal() or not 4 <= int(cost) <= 31:
+            msg = 'The work factor must be a number from 4 to 31.'
+            print(msg)
+            return
 
-        keys = key.split('.')
-        isinvalid = lambda key: ('[' in key and not ']' in key) or ('[]' in key) or (']' in key and not '[' in key)
-        islist = lambda key: '[' in key
+        self.cost = int(cost)
+        msg = 'New passwords will be hashed with a work factor of {}.'.format(self.cost)
+        print(msg)
 
-        for path in paths:
-            morlockfile = self.findmorlockfile({'path': path})
+    def do_unlockttl(self, seconds: str) -> None:
+        'Show or set for how many seconds a verified password is remembered (0 never remembers)'
 
-            if morlockfile is None:
-                msg = "'{}' is not loaded; skipping...".format(path)
-                print(msg)
-                return
+        if seconds == '':
+            msg = 'Verified passwords are remembered for {:g} seconds.'.format(self.unlockttl)
+            print(msg)
+            return
 
-            base = refr = copy.deepcopy(morlockfile.content['data'])
-            last = keys[-1]
+        try:
+            ttl = float(seconds)
+        except ValueError:
+            ttl = -1
 
-            for key in keys:
-                # Key is of type key[a]...[z] (aka list)
-                if islist(key):
-                    name, idxs = key.split('[', 1)
-                    idxs = idxs[:-1].split('][')
-                    exists = (name in refr)
+        if not ttl >= 0:
+            msg = 'The number of seconds must not be negative.'
+            print(msg)
+            return
 
-                    # Checking for keys with: only opening/ closing bracket; [] without index
-                    if isinvalid(key):
-                        msg = 'Invalid key found. Aborting.'
-                        print(msg)
-                        return
+        self.unlockttl = ttl
+        if ttl == 0:
+            self.unlocked.clear()
 
-                    # Checking for keys without identifier (e.g.: [0][1][2])
-                    if name == '':
-                        msg = "'{}' is an invalid key.".format(key)
-                        print(msg)
-                        return
+        msg = 'Verified passwords will be remembered for {:g} seconds.'.format(self.unlockttl)
+        print(msg)
 
-                    # refr[name] does not exist or isn't a list
-                    if not exists or not isinstance(refr[name], list):
-                        morlockfile.modified = True
-                        refr[name] = []
-
-                    # Setting a reference 
-                    lst = refr[name]
-                    for i in range(len(idxs)):
-                        idx = idxs[i]
-
-                        # If list index is not a digit (e.g lst['a']; correct -> lst.a)
-                        if not idx.isdigit():
-                            msg = 'Forbidden non-digit index found. Aborting.'
-                            print(msg)
-                            return
-
-                        islastidx = (i == len(idxs) - 1)
-                        idx = int(idx)
-
-                        # Handling indices out of bound of list
-                        if not idx in range(-len(lst), len(lst) + 1):
-                            msg = 'Given index is out of bounds. Aborting.'
-                            print(msg)
-                            return
-
-                        # refr[name][idx-0][idx-1]...[idx-n] isn't a list
-                        # Needs to recheck since it's in a loop
-                        if not isinstance(lst, list):
-                            lst = []
-
-                        # If it's pushing time
-                        if islastidx:
-                            # Adding a new value
-                            if idx == len(lst):
-                                morlockfile.modified = True
-                                lst.append(val)
-                            # Editing existing value
-                            elif MorlockCli.listgetdefault(lst, idx) != val:
-                                morlockfile.modified = True
-                                lst[idx] = val
-
-                        # Going deeper into the list
-                        lst = lst[idx]
-
-                # Key is of type key.a...z (aka dict)
-                else:
-                    islastkey = (key == last)
-                    exists = (key in refr)
-
-                    # If that's the last iteration, set the value
-                    if islastkey:
-                        if refr.get(key, MorlockEmpty) != val:
-                            morlockfile.modified = True
-                            refr[key] = val
-                    else:
-                        # The user wants to set a deep-level dict
-                        if not exists:
-                            morlockfile.modified = True
-                            refr[key] = {}
-                        elif not isinstance(refr[key], dict):
-                            morlockfile.modified = True
-                            refr[key] = {}
+    def do_writeback(self, args: str) -> None:
+        """Show or set whether `save` writes in the background.
+        Syntax: `writeback [on [SECONDS] | off]`
+        With write-back on, `save` only queues files: a background thread
+        writes each at most SECONDS (0.5 by default) after it was queued, and
+        a file saved again meanwhile is written once. `flush` waits for the
+        queue and reports errors; quitting flushes it too.
+        """
 
-                    # Going deeper into the dict
-                    refr = refr[key]
+        args = shlex.split(args)
 
-            morlockfile.content['data'] = base
+        if not args:
+            if self.writer is None:
+                msg = 'Write-back is off.'
+            else:
+                msg = 'Write-back is on; files are written within {:g} seconds of `save`.'.format(self.writer.delay)
+            print(msg)
+            return
 
-    def do_activate(self, path: str) -> None:
-        'Activate given MorlockFile'
+        if args == ['off']:
+            if self.writer is not None:
+                self.do_flush('')
+                self.writer = None
 
-        # Finding file with given path
-        morlockfile = self.findmorlockfile({'path': path})
-        if morlockfile is None:
-            msg = "'{}' is not currently loaded.".format(path)
+            msg = 'Write-back is off.'
             print(msg)
             return
 
-        if self.activefile is None:
-            self.activefile = morlockfile
-            self.prompt = 'morlock({})> '.format(path)
-            msg = "'{}' activated successfully.".format(path)
+        try:
+            delay = -1 if args[0] != 'on' or len(args) > 2 else float(args[1]) if len(args) == 2 else 0.5
+        except ValueError:
+            delay = -1
+
+        if not delay >= 0:
+            msg = 'Syntax: `writeback [on [SECONDS] | off]`, SECONDS not negative.'
             print(msg)
+            return
+
+        if self.writer is None:
+            self.writer = MorlockWriter(delay)
         else:
-            path = self.activefile.path
-            msg = "'{}' is currently active.".format(path)
+            self.writer.delay = delay
 
-    def do_deactivate(self, _: str=None) -> None:
-        'Deactivate currently active MorlockFile'
+        msg = 'Write-back is on; files are written within {:g} seconds of `save`.'.format(delay)
+        print(msg)
 
-        # If there's no active file
-        if self.activefile is None:
-            msg = "There's no currently active file."
-            print(msg)
+    def do_flush(self, _: str=None) -> None:
+        'Wait until every file queued by `save` in write-back mode is on disk, and report the ones that failed'
+
+        if self.writer is None:
             return
 
-        self.activefile = None
-        self.prompt = 'morlock> '
+        self.writer.wait()
+        written, errors = self.writer.take()
 
-    def do_switch(self, path: str) -> None:
-        '`switch [FILE]` is a shortcut for `deactivate; activate [FILE]`'
+        for morlockfile, error in errors:
+            msg = "Could not save '{}': {}".format(morlockfile.path, error)
+            print(msg)
 
-        morlockfile = self.findmorlockfile({'path': path})
+            # Still unsaved, so `save` can try again
+            if morlockfile.registry is not None:
+                morlockfile.modified = True
 
-        # If to-be-active file is not loaded
-        if morlockfile is None:
-            msg = "'{}' is not loaded.".format(path)
-            print(msg)
-        else:
-            if self.activefile is not None:
-                self.do_deactivate()
-            
-            self.do_activate(path)
+        msg = '{} file(s) written, {} failed.'.format(written, len(errors))
+        print(msg)
 
-    def do_save(self, paths: str) -> None:
-        'Save given MorlockFile(s) (e.g.: `save`, `save file1 file2 file3`)'
+    def settle(self) -> None:
+        'Wait for queued writes before reading files from disk'
 
-        def save(path: str) -> None:
-            # Finding given file
-            morlockfile = self.findmorlockfile({ 'path': path })
-            if morlockfile is None:
-                msg = "File '{}' not found.".format(path)
-                print(msg)
-                return
-            elif not morlockfile.modified and not morlockfile.wiped:
-                msg = "File '{}' was not modified; skipping.".format(path)
-                print(msg)
-                return
+        if self.writer is not None:
+            self.writer.wait()
 
-            # Generating content to prepend to file
-            oldcontent = morlockfile.data
-            newcontent = morlockfile.gen_bytes()
-            
-            with open(morlockfile.path, 'wb') as f:
-                f.write(newcontent + oldcontent)
+    def do_forget(self, _: str=None) -> None:
+        'Forget every password verified in this session'
 
-            if morlockfile.wiped:
-                morlockfile.wiped = False
-                wasactive = False
-                msg = "'{}' saved successfully. Unloading file...".format(morlockfile.path)
-                print(msg)
-                self.do_unload(morlockfile.path)
-            else:
-                morlockfile.modified = False
-                wasactive = (self.activefile == morlockfile)
-                msg = "'{}' saved successfully. Reloading file...".format(morlockfile.path)
-                print(msg)
-                self.do_reload(morlockfile.path)
+        self.unlocked.clear()
+        msg = 'Verified passwords forgotten.'
+        print(msg)
 
-            # Re-activating if necessary
-            if wasactive:
-                self.do_activate(morlockfile.path)
+    def do_unlock(self, paths: str) -> None:
+        'Remove password from given MorlockFile(s)'
 
         if paths != '':
-            for path in shlex.split(paths):
-                save(path)
+            paths = self.expandpaths(shlex.split(paths))
         elif self.activefile is not None:
-            save(self.activefile.path)
+            paths = [self.activefile.path]
         else:
-            msg = "There's no active file and zero files were given to be saved."
+            msg = "There's no active file and zero files were given to be unlocked."
             print(msg)
             return
 
-    def do_unlock(self, paths: str) -> None:
-        'Remove password from given MorlockFile(s)'
-
-        def unlock(path: str) -> None:
+        locked = []
+        for path in paths:
             # Finding given file
-            morlockfile = self.findmorlockfile({ 'path': path })
+            morlockfile = self.loadedfiles.get(path)
             if morlockfile is None:
                 msg = "'{}' not found.".format(path)
                 print(msg)
-                return
 
             # If it already has no password
-            if morlockfile.content['password'] is None:
+            elif morlockfile.content['password'] is None:
                 msg = "'{}' has already no password.".format(path)
                 print(msg)
-                return
 
-            # Checking if given password is the correct one
-            match = MorlockCli.passwordcheck(morlockfile.content['password'], path)
+            else:
+                locked.append(morlockfile)
+
+        # Checking if given passwords are the correct ones
+        matches = self.passwordchecks([(m.content['password'], m.path) for m in locked])
+        for morlockfile, match in zip(locked, matches):
             if match:
                 morlockfile.modified = True
                 morlockfile.content['password'] = None
-                msg = "'{}' unlocked successfully.".format(path)
+                msg = "'{}' unlocked successfully.".format(morlockfile.path)
                 print(msg)
             else:
                 msg = "Wrong password inserted."
                 print(msg)
 
+    def do_lock(self, paths: str) -> None:
+        'Set password for given MorlockFile(s)'
+
         if paths != '':
-            for path in shlex.split(paths):
-                unlock(path)
+            paths = self.expandpaths(shlex.split(paths))
         elif self.activefile is not None:
-            unlock(self.activefile.path)
+            paths = [self.activefile.path]
         else:
-            msg = "There's no active file and zero files were given to be unlocked."
+            msg = "There's no active file and zero files were given to be locked."
             print(msg)
             return
 
-    def do_lock(self, paths: str) -> None:
-        'Set password for given MorlockFile(s)'
-
-        def lock(path: str) -> None:
-            morlockfile = self.findmorlockfile({ 'path': path })
+        targets = []
+        for path in paths:
+            morlockfile = self.loadedfiles.get(path)
 
             # If no files were found
             if morlockfile is None:
                 msg = "'{}' not found.".format(path)
                 print(msg)
-                return
+            else:
+                targets.append(morlockfile)
+
+        # Checking for existing passwords (user must provide in order to change them)
+        locked = [m for m in targets if m.content['password'] is not None]
+        for morlockfile in locked:
+            msg = "'{}' is locked.".format(morlockfile.path)
+            print(msg)
 
-            # Checking for existing password (user must provide in order to change it)
-            if morlockfile.content['password'] is not None:
-                msg = "'{}' is locked.".format(path)
+        matches = self.passwordchecks([(m.content['password'], m.path) for m in locked])
+        for morlockfile, match in zip(locked, matches):
+            if not match:
+                msg = 'Wrong password inserted.'
                 print(msg)
-                match = MorlockCli.passwordcheck(morlockfile.content['password'], path)
-                if not match:
-                    msg = 'Wrong password inserted.'
-                    print(msg)
-                    return
+                targets.remove(morlockfile)
 
-            # Getting and setting new password
-            msg = "Type in new password for '{}': ".format(path)
-            newpassword = input(msg)
-            newpassword = bcrypt.hashpw(newpassword.encode('utf-8'), bcrypt.gensalt())
-            morlockfile.content['password'] = newpassword.decode('utf-8')
-            morlockfile.modified = True
-            msg = "Password for '{}' changed successfully.".format(path)
-            print(msg)
+        # Getting new passwords, then hashing them all at once
+        newpasswords = []
+        for morlockfile in targets:
+            msg = "Type in new password for '{}': ".format(morlockfile.path)
+            newpasswords.append(self.ask(msg, 'newpassword'))
 
-        if paths != '':
-            for path in shlex.split(paths):
-                lock(path)
-        elif self.activefile is not None:
-            lock(self.activefile.path)
-        else:
-            msg = "There's no active file and zero files were given to be locked."
+        with STATS.phase('password.hash') as phase:
+            hashes = mapordered(functools.partial(hashpassword, rounds=self.cost), newpasswords, processes=True)
+            phase.count = len(newpasswords)
+
+        for morlockfile, newpassword in zip(targets, hashes):
+            morlockfile.content['password'] = newpassword
+            morlockfile.modified = True
+            self.remember(newpassword)
+            msg = "Password for '{}' changed successfully.".format(morlockfile.path)
             print(msg)
-            return
 
     def do_clear(self, paths: str, all: bool=False) -> None:
         "Clear morlock file's data"
 
         def clear(path: str) -> None:
             # Find given file
-            morlockfile = self.findmorlockfile({'path': path})
+            morlockfile = self.loadedfiles.get(path)
 
             if morlockfile is None:
                 msg = "'{}' is not loaded; skipping...".format(path)
@@ -591,13 +2616,365 @@ class MorlockCli(cmd.Cmd):
         'Remove all traces of Morlock from file'
         self.do_clear(paths, all=True)
  
+    def do_catalog(self, paths: str) -> None:
+        'Index the headers of given file(s) into the catalog, rescanning only changed ones; with none, refresh the whole catalog'
+
+        self.settle()
+        args = shlex.split(paths)
+        catalog = self.opencatalog()
+
+        if args:
+            recursive = '-r' in args
+            dirs = [(arg, recursive) for arg in args if os.path.isdir(arg)]
+            files = [path for path in self.expandpaths(args) if MorlockCli.extension(path) in CONTAINERS]
+        else:
+            dirs = []
+            files = catalog.paths()
+
+        scanned, unchanged, removed, unreadable = catalog.refresh(files, dirs)
+        for path in unreadable:
+            msg = "Could not read '{}'.".format(path)
+            print(msg)
+
+        msg = '{} file(s) scanned, {} unchanged, {} removed from the catalog.'.format(scanned, unchanged, removed)
+        print(msg)
+
+    def do_find(self, terms: str) -> None:
+        'Find catalogued files matching all given terms (e.g.: `find data.artist=="X" data.year!=1999 data.album`)'
+
+        try:
+            found = self.opencatalog().find(shlex.split(terms))
+        except ValueError as e:
+            print(e)
+            return
+
+        for path, status, name in found:
+            if status == 'ok':
+                print(path)
+            else:
+                msg = '{} ({})'.format(path, status)
+                print(msg)
+
+        msg = '{} file(s) found.'.format(len(found))
+        print(msg)
+
+    def opencatalog(self):
+        'Open the header catalog on first use'
+
+        if self.catalog is None:
+            from catalog import MorlockCatalog
+
+            self.catalog = MorlockCatalog()
+
+        return self.catalog
+
+    def do_export(self, args: str) -> None:
+        """Write the headers of given file(s), as saved on disk, as JSON lines.
+        Syntax: `export [--output FILE] [-r] FILE-1|DIR-1 ... FILE-N|DIR-N`
+        Each line is `{"path": ..., "name": ..., "data": ...}`, plus the
+        `password` hash of locked files. Lines go to stdout unless `--output`
+        is given; files are read a batch at a time, so memory stays flat
+        however large the library.
+        """
+
+        self.settle()
+        args = shlex.split(args)
+        output = None
+        if '--output' in args:
+            i = args.index('--output')
+            if i + 1 == len(args):
+                msg = 'An output file must be provided.'
+                print(msg)
+                return
+
+            output = args[i + 1]
+            del args[i:i + 2]
+
+        if not args:
+            msg = 'At least one file or directory must be provided.'
+            print(msg)
+            return
+
+        def read(path: str):
+            try:
+                return readfile(path)
+            except (OSError, ValueError) as e:
+                return e
+
+        try:
+            f = sys.stdout if output is None else open(output, 'w', encoding='utf-8')
+        except OSError as e:
+            msg = "Could not open '{}': {}".format(output, e.strerror)
+            print(msg)
+            return
+
+        exported = 0
+        try:
+            paths = (path for path in self.iterpaths(args) if MorlockCli.extension(path) in CONTAINERS)
+            for batch in batches(paths):
+                for path, result in zip(batch, mapordered(read, batch)):
+                    if isinstance(result, Exception):
+                        msg = "Could not export '{}': {}".format(path, result.strerror if isinstance(result, OSError) else result)
+                        print(msg, file=sys.stderr)
+                        continue
+
+                    content = result[4]
+                    if content is None:
+                        continue
+
+                    record = {'path': path, 'name': content['name'], 'data': content['data']}
+                    if content['password'] is not None:
+                        record['password'] = content['password']
+
+                    f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+                    exported += 1
+        finally:
+            if output is not None:
+                f.close()
+
+        msg = '{} header(s) exported.'.format(exported)
+        print(msg, file=sys.stderr)
+
+    def do_import(self, args: str) -> None:
+        """Write headers back from JSON lines made by `export`.
+        Syntax: `import FILE` (`-` reads stdin)
+        A record replaces the `name`, `data` and `password` hash it holds,
+        keeping the rest of the file's header. Consecutive records for one
+        file are merged, so every file is written once. Loaded files are
+        updated too, unless they have unsaved changes; locked files need
+        their password.
+        """
+
+        self.settle()
+        args = shlex.split(args)
+        if len(args) != 1:
+            msg = 'A single file of records must be provided.'
+            print(msg)
+            return
+
+        try:
+            f = sys.stdin if args[0] == '-' else open(args[0], encoding='utf-8')
+        except OSError as e:
+            msg = "Could not open '{}': {}".format(args[0], e.strerror)
+            print(msg)
+            return
+
+        counts = {'written': 0, 'unchanged': 0, 'skipped': 0}
+
+        # Invalid lines are reported and dropped while the records stream in
+        def records():
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+
+                if not isinstance(record, dict) or not isinstance(record.get('path'), str) \
+                        or not isinstance(record.get('data', {}), dict) \
+                        or not isinstance(record.get('password'), (str, type(None))):
+                    msg = 'Line {} is not a valid record; skipping...'.format(n)
+                    print(msg)
+                    counts['skipped'] += 1
+                    continue
+
+                yield record
+
+        def merge(group) -> dict:
+            merged = {}
+            for record in group:
+                merged.update(record)
+
+            return merged
+
+        # Unloaded files are read and written on the pool, loaded ones are used as they are
+        def read(path: str):
+            morlockfile = self.loadedfiles.get(path)
+            if morlockfile is not None:
+                return morlockfile
+
+            try:
+                st, offset, version, flags, content, digest, _ = readfile(path)
+            except (OSError, ValueError) as e:
+                return e
+
+            morlockfile = MorlockFile(path, offset, copy.deepcopy(DEFAULT) if content is None else content, st)
+            morlockfile.version = version
+            morlockfile.codec = flags
+            morlockfile.digest = digest
+            return morlockfile
+
+        def write(morlockfile: MorlockFile) -> Exception:
+            try:
+                morlockfile.write(self.padding)
+            except OSError as e:
+                return e
+
+        groups = (merge(group) for _, group in itertools.groupby(records(), lambda record: MorlockRegistry.key(record['path'])))
+
+        try:
+            for batch in batches(groups):
+                pending = []
+                for record in batch:
+                    path = record['path']
+                    morlockfile = self.loadedfiles.get(path)
+
+                    if morlockfile is not None and (morlockfile.modified or morlockfile.wiped):
+                        msg = "'{}' has unsaved changes; skipping...".format(path)
+                    elif not MorlockCli.extension(path) in CONTAINERS:
+                        msg = "Extension '{}' is not supported.".format(MorlockCli.extension(path))
+                    elif not os.path.isfile(path):
+                        msg = "'{}' not found.".format(path)
+                    else:
+                        pending.append(record)
+                        continue
+
+                    print(msg)
+                    counts['skipped'] += 1
+
+                files = mapordered(read, [record['path'] for record in pending])
+                changes = []
+                locked = []
+
+                for record, morlockfile in zip(pending, files):
+                    if isinstance(morlockfile, Exception):
+                        msg = "Could not read '{}': {}".format(record['path'], morlockfile.strerror if isinstance(morlockfile, OSError) else morlockfile)
+                        print(msg)
+                        counts['skipped'] += 1
+                        continue
+
+                    content = dict(morlockfile.content)
+                    content.update((key, record[key]) for key in DEFAULT if key in record)
+                    if content == morlockfile.content:
+                        counts['unchanged'] += 1
+                        continue
+
+                    # Loaded files were unlocked when they were loaded
+                    if morlockfile.content['password'] is not None and morlockfile.registry is None:
+                        locked.append(len(changes))
+                    changes.append((morlockfile, content))
+
+                # Checking passwords of locked files all at once
+                checks = [(changes[i][0].content['password'], changes[i][0].path) for i in locked]
+                for i, match in zip(locked, self.passwordchecks(checks)):
+                    if not match:
+                        msg = "Incorrect password for '{}'; skipping...".format(changes[i][0].path)
+                        print(msg)
+                        counts['skipped'] += 1
+                        changes[i] = None
+
+                changes = [change for change in changes if change is not None]
+                for morlockfile, content in changes:
+                    morlockfile.content = content
+                    if morlockfile.registry is not None:
+                        morlockfile.modified = True
+
+                for (morlockfile, _), error in zip(changes, mapordered(write, [morlockfile for morlockfile, _ in changes])):
+                    if error is not None:
+                        msg = "Could not write '{}': {}".format(morlockfile.path, error)
+                        print(msg)
+                        counts['skipped'] += 1
+                        continue
+
+                    if morlockfile.registry is not None:
+                        morlockfile.modified = False
+                    counts['written'] += 1
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+        msg = '{written} file(s) written, {unchanged} unchanged, {skipped} skipped.'.format(**counts)
+        print(msg)
+
+    def do_stats(self, args: str) -> None:
+        """Show counters, timings and bytes read/written per phase of `load`, `set`, `save` and password checks.
+        Syntax: `stats [on|off|reset|trace FILE|trace off]`
+        `trace FILE` also appends every timed phase to FILE as a JSON line.
+        """
+
+        args = shlex.split(args)
+
+        if args == ['on']:
+            STATS.enable()
+            msg = 'Stats are on.'
+        elif args == ['off']:
+            STATS.disable()
+            msg = 'Stats are off.'
+        elif args == ['reset']:
+            STATS.phases.clear()
+            msg = 'Stats reset.'
+        elif args == ['trace', 'off']:
+            STATS.closetrace()
+            msg = 'Tracing stopped.'
+        elif len(args) == 2 and args[0] == 'trace':
+            try:
+                STATS.enable(args[1])
+            except OSError as e:
+                msg = "Could not open '{}': {}".format(args[1], e.strerror)
+            else:
+                msg = "Stats are on and traced to '{}'.".format(args[1])
+        elif args:
+            msg = 'Unknown option. See `help stats`.'
+        elif not STATS.phases:
+            msg = 'Nothing measured yet.' if STATS.enabled else 'Stats are off. Turn them on with `stats on`.'
+        else:
+            rows = ['{:<16}{:>10}{:>14}{:>12}{:>14}{:>14}'.format('phase', 'count', 'total ms', 'mean ms', 'read B', 'written B')]
+            for name, (count, seconds, read, written) in sorted(STATS.phases.items()):
+                mean = seconds * 1000 / count if count else 0
+                rows.append('{:<16}{:>10}{:>14.3f}{:>12.3f}{:>14}{:>14}'.format(name, count, seconds * 1000, mean, read, written))
+            msg = '\n'.join(rows)
+
+        print(msg)
+
+    def do_status(self, paths: str) -> None:
+        """List loaded file(s) - given or all - with changes `save` would write.
+        Syntax: `status [FILE-1 ... FILE-N]`
+        Files are compared by their encoded header, so edits that were undone
+        or that set values a file already had don't count, and such files are
+        no longer marked as modified.
+        """
+
+        self.settle()
+        args = shlex.split(paths)
+        flagged = self.loadedfiles.modified | self.loadedfiles.wiped
+        if args:
+            morlockfiles = [morlockfile for morlockfile in self.targets(args) if morlockfile in flagged]
+        else:
+            morlockfiles = sorted(flagged, key=lambda morlockfile: morlockfile.path)
+
+        dirty = set(self.dirtyfiles(morlockfiles))
+        for morlockfile in morlockfiles:
+            if morlockfile in dirty:
+                msg = '{}: {}'.format('wiped' if morlockfile.wiped else 'modified', morlockfile.path)
+                print(msg)
+
+        msg = '{} file(s) with unsaved changes'.format(len(dirty))
+        if len(dirty) < len(morlockfiles):
+            msg += ', {} edited back to what is saved'.format(len(morlockfiles) - len(dirty))
+        print(msg + '.')
+
+    def dirtyfiles(self, morlockfiles) -> list[MorlockFile]:
+        'Return the given flagged files `save` would change, unflagging the modified ones it would not'
+
+        dirty = []
+        for morlockfile in morlockfiles:
+            if morlockfile.dirty():
+                dirty.append(morlockfile)
+            elif not morlockfile.wiped:
+                morlockfile.modified = False
+
+        return dirty
+
     def do_EOF(self, _) -> bool:
         'Clean up and exit'
 
-        morlockfile = self.findmorlockfile({ 'modified': True })
-        if morlockfile is not None:
+        self.do_flush()
+
+        if self.dirtyfiles(self.loadedfiles.modified | self.loadedfiles.wiped):
             msg = "\nThere are modified files. Do you want to quit and discard all changes (y/n)? "
-            action = input(msg)
+            action = self.ask(msg, 'discard', 'n')
 
             if action.lower() == 'n':
                 return False
@@ -609,13 +2986,66 @@ class MorlockCli(cmd.Cmd):
         'Alias to EOF'
         return self.do_EOF(_)
 
-    def findmorlockfile(self, prop: dict) -> MorlockFile:
-        for loadedfile in self.loadedfiles:
-            for key, val in prop.items():
-                if hasattr(loadedfile, key) and getattr(loadedfile, key) == val:
-                    return loadedfile
+    def execute(self, line: str) -> bool:
+        'Run a single command line; returns True when the command asks to quit'
 
-        return None
+        command, _, args = line.strip().partition(' ')
+        func = getattr(self, 'do_' + command, None)
+
+        if func is None:
+            msg = "Unknown command '{}'.".format(command)
+            print(msg)
+            return False
+
+        return func(args.strip())
+
+    def ask(self, msg: str, key: str, default: str = '') -> str:
+        'Answer a question from the preset answers, falling back to asking the user'
+
+        if key in self.answers:
+            return self.answers[key]
+
+        if not self.interactive:
+            return default
+
+        return input(msg)
+
+    def expandpaths(self, args: list[str]) -> list[str]:
+        'Expand globs and directories (recursively after a `-r` flag) into supported files'
+        return list(self.iterpaths(args))
+
+    def iterpaths(self, args: list[str]):
+        'Like `expandpaths`, yielding paths as directories are walked rather than listing them all first'
+
+        recursive = '-r' in args
+
+        for arg in args:
+            if arg == '-r':
+                continue
+
+            if os.path.isdir(arg):
+                if recursive:
+                    walk = os.walk(arg)
+                else:
+                    walk = [(arg, [], os.listdir(arg))]
+
+                # Each directory is sorted on its own, subdirectories after its files
+                for root, dirs, names in walk:
+                    dirs.sort()
+                    found = (os.path.join(root, name) for name in names)
+                    yield from sorted(p for p in found if MorlockCli.extension(p) in CONTAINERS and os.path.isfile(p))
+                continue
+
+            import glob
+
+            if glob.has_magic(arg):
+                yield from sorted(glob.glob(arg, recursive=recursive))
+            else:
+                yield arg
+
+    @staticmethod
+    def extension(path: str) -> str:
+        return os.path.splitext(path)[1].replace('.', '').lower()
 
     @staticmethod
     def isjson(txt: str) -> bool:
@@ -628,21 +3058,56 @@ class MorlockCli(cmd.Cmd):
 
     @staticmethod
     def isvalid(content: dict) -> bool:
+        if not isinstance(content, dict):
+            return False
+
         for key in DEFAULT.keys():
             if not key in content:
                 return False
 
         return True
 
-    @staticmethod
-    def passwordcheck(psw: str, path: str) -> bool:
-        msg = "Type in password for '{}': ".format(path)
-        password = input(msg)
-        return bcrypt.checkpw(password.encode('utf-8'), psw.encode('utf-8'))
+    def passwordcheck(self, psw: str, path: str) -> bool:
+        return self.passwordchecks([(psw, path)])[0]
+
+    def passwordchecks(self, items: list[tuple[str, str]]) -> list[bool]:
+        """Check the password of each `(hash, path)`. Hashes verified in this
+        session within `unlockttl` pass right away; for the others, passwords
+        are asked for first and then checked all at once on a process pool.
+        """
+
+        now = time.monotonic()
+        matches = [None] * len(items)
+        pending = {}
+
+        for i, (psw, path) in enumerate(items):
+            if self.unlocked.get(psw, 0) > now:
+                matches[i] = True
+                STATS.add('password.cached')
+                continue
+
+            msg = "Type in password for '{}': ".format(path)
+            password = self.ask(msg, 'password')
+            pending.setdefault((password, psw), []).append(i)
+
+        # Identical password/hash pairs are only checked once
+        checks = list(pending)
+        with STATS.phase('password.check') as phase:
+            results = mapordered(checkpassword, checks, processes=True)
+            phase.count = len(checks)
+
+        for check, match in zip(checks, results):
+            if match:
+                self.remember(check[1])
+
+            for i in pending[check]:
+                matches[i] = match
+
+        return matches
+
+    def remember(self, psw: str) -> None:
+        'Skip checking a verified password hash until `unlockttl` expires'
+
+        if self.unlockttl > 0:
+            self.unlocked[psw] = time.monotonic() + self.unlockttl
 
-    @staticmethod
-    def listgetdefault(lst: list, idx: int, default=MorlockEmpty):
-        try:
-            return lst.index(idx)
-        except ValueError:
-            return default
\ No newline at end of file
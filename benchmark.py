@@ -0,0 +1,455 @@
+import os, sys, io, json, time, random, shutil, tempfile, platform, argparse, contextlib, subprocess, statistics, tracemalloc
+import Morlock
+
+USAGE = '''Benchmark Morlock on synthetic MP3, OGG, FLAC and WAV files.
+
+Every case is timed over a few runs (median and minimum are kept), then
+run once more under tracemalloc for its peak memory. Bytes read and
+written come from /proc/self/io where it exists. Results are printed as
+JSON, or written to --output; --compare checks them against an earlier
+run and exits with 1 when a case got slower than the threshold allows.
+The run also fails when `main.py exec quit` takes longer than the startup
+budget.
+'''
+
+PASSWORD = 'benchmark'
+
+# Seconds a cold `main.py exec quit` may take, whether bytecode is cached or not
+STARTUP_BUDGET = 0.15
+
+# Synthetic audio: enough structure for the container parsers, zeros after that
+def mp3audio(size: int) -> bytes:
+    'An ID3v2 tag followed by MPEG frames'
+
+    tag = b'ID3\x04\x00\x00' + bytes([0, 0, 0x02, 0x00]) + bytes(256)
+    frame = b'\xff\xfb\x90\x64' + bytes(413)
+    return (tag + frame * (size // len(frame) + 1))[:max(size, len(tag) + len(frame))]
+
+def oggaudio(size: int) -> bytes:
+    'A Vorbis identification page followed by zeros'
+
+    page = b'OggS\x00\x02' + bytes(8) + b'\x01\x00\x00\x00' + bytes(8) + bytes([1, 30]) + b'\x01vorbis' + bytes(23)
+    return page + bytes(max(size - len(page), 0))
+
+def flacaudio(size: int) -> bytes:
+    'STREAMINFO and a last PADDING block, then frames'
+
+    blocks = b'fLaC' + b'\x00' + (34).to_bytes(3, 'big') + bytes(34) + b'\x81' + (64).to_bytes(3, 'big') + bytes(64)
+    frame = b'\xff\xf8\x69\x08' + bytes(508)
+    return (blocks + frame * (size // len(frame) + 1))[:max(size, len(blocks) + len(frame))]
+
+def wavaudio(size: int) -> bytes:
+    'A RIFF/WAVE header with `fmt ` and `data` chunks, then 16-bit silence'
+
+    samples = max(size - 44, 0)
+    fmt = b'fmt ' + (16).to_bytes(4, 'little') + b'\x01\x00\x02\x00' + (44100).to_bytes(4, 'little') + (176400).to_bytes(4, 'little') + b'\x04\x00\x10\x00'
+    riff = b'RIFF' + (36 + samples).to_bytes(4, 'little') + b'WAVE'
+    return riff + fmt + b'data' + samples.to_bytes(4, 'little') + bytes(samples)
+
+AUDIO = {
+    'mp3': mp3audio,
+    'ogg': oggaudio,
+    'flac': flacaudio,
+    'wav': wavaudio
+}
+
+def content(size: int, seed: int = 0) -> dict:
+    'Morlock content whose JSON is roughly `size` bytes: tags, cue points and a waveform summary'
+
+    rng = random.Random(seed)
+    data = {
+        'artist': 'Artist {}'.format(seed % 100),
+        'year': 1950 + seed % 70,
+        'tags': ['tag{}'.format(i) for i in range(4)],
+        'cues': [],
+        'waveform': []
+    }
+
+    # A cue takes ~55 bytes of JSON and a waveform sample ~6
+    room = max(size - 150, 0)
+    data['cues'] = [{'t': round(rng.random() * 300, 3), 'label': 'cue {}'.format(i), 'id': i} for i in range(room // 2 // 55)]
+    data['waveform'] = [rng.randint(-32768, 32767) for _ in range(room // 2 // 7)]
+
+    return {'name': 'track {}'.format(seed), 'password': None, 'data': data}
+
+def makefiles(directory: str, kind: str, count: int, audiosize: int, headersize: int, locked: bool = False) -> list[str]:
+    'Write `count` files with a Morlock header in front of synthetic audio'
+
+    os.makedirs(directory, exist_ok=True)
+    audio = AUDIO[kind](audiosize)
+    psw = Morlock.hashpassword(PASSWORD, rounds=4) if locked else None
+    paths = []
+
+    for i in range(count):
+        path = os.path.join(directory, '{:05d}.{}'.format(i, kind))
+        with open(path, 'wb') as f:
+            f.write(audio)
+
+        morlockfile = Morlock.MorlockFile(path, 0, content(headersize, i))
+        morlockfile.content['password'] = psw
+        morlockfile.write()
+        paths.append(path)
+
+    return paths
+
+def iocounters() -> tuple[int, int]:
+    'Bytes this process read and wrote so far, or None where /proc/self/io is missing'
+
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+    except OSError:
+        return None
+
+    return int(counters['rchar']), int(counters['wchar'])
+
+def newcli(**attrs) -> Morlock.MorlockCli:
+    'A MorlockCli that never prompts: passwords and answers are preset'
+
+    cli = Morlock.MorlockCli()
+    cli.interactive = False
+    cli.answers = {'password': PASSWORD, 'newpassword': PASSWORD, 'name': 'benchmark', 'protect': 'n', 'discard': 'y'}
+    cli.cost = 4
+
+    for name, value in attrs.items():
+        setattr(cli, name, value)
+
+    return cli
+
+def quiet(func, *args):
+    'Run `func` with its output thrown away'
+
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        return func(*args)
+
+class Benchmark:
+    'Runs cases and collects their results'
+
+    def __init__(self, repeat: int) -> None:
+        self.repeat = repeat
+        self.results = []
+
+    def case(self, name: str, params: dict, run, setup=None, repeat: int = None) -> dict:
+        """Time `run(state)` where `state = setup()`; setup is never timed.
+        Records median and minimum seconds per call, peak traced memory and
+        I/O bytes of a single call.
+        """
+
+        # Without setup, quick cases run in batches of at least 10 ms like `timeit` does
+        number = 1
+        if setup is None:
+            while True:
+                start = time.perf_counter()
+                for _ in range(number):
+                    run(None)
+                if time.perf_counter() - start >= 0.01:
+                    break
+                number *= 10
+
+        times = []
+        for _ in range(repeat or self.repeat):
+            state = setup() if setup is not None else None
+            start = time.perf_counter()
+            for _ in range(number):
+                run(state)
+            times.append((time.perf_counter() - start) / number)
+
+        # One more run for memory and I/O, which tracing would slow down
+        state = setup() if setup is not None else None
+        before = iocounters()
+        tracemalloc.start()
+        run(state)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        after = iocounters()
+
+        result = {
+            'name': name,
+            'params': params,
+            'runs': len(times),
+            'number': number,
+            'median_s': statistics.median(times),
+            'min_s': min(times),
+            'peak_bytes': peak,
+            'read_bytes': after[0] - before[0] if before else None,
+            'written_bytes': after[1] - before[1] if before else None
+        }
+        self.results.append(result)
+
+        msg = '{:<12} {:<72} {:>10.6f} s {:>12} B peak'.format(name, json.dumps(params), result['median_s'], peak)
+        print(msg, file=sys.stderr)
+
+        return result
+
+def commandcases(bench: Benchmark, root: str, kind: str, count: int, audiosize: int, headersize: int) -> None:
+    'load, set, get, save, lock and unlock on `count` files'
+
+    params = {'kind': kind, 'files': count, 'audio': audiosize, 'header': headersize}
+    fixtures = os.path.join(root, 'fixtures-{}-{}-{}-{}'.format(kind, count, audiosize, headersize))
+    locked = fixtures + '-locked'
+    makefiles(fixtures, kind, count, audiosize, headersize)
+    makefiles(locked, kind, count, audiosize, headersize, locked=True)
+    work = os.path.join(root, 'work')
+
+    # Saving rewrites files, so every run starts from a fresh copy
+    def copy(source: str) -> str:
+        shutil.rmtree(work, ignore_errors=True)
+        shutil.copytree(source, work)
+        return ' '.join(sorted(os.path.join(work, name) for name in os.listdir(work)))
+
+    def loaded(source: str = fixtures, **attrs):
+        paths = copy(source)
+        cli = newcli(**attrs)
+        quiet(cli.do_load, paths)
+        return cli, paths
+
+    def edited(value: str):
+        def setup():
+            cli, paths = loaded()
+            quiet(cli.do_set, 'bench {} {}'.format(json.dumps(value), paths))
+            return cli, paths
+        return setup
+
+    bench.case('load', params, lambda state: quiet(state[1].do_load, state[0]), lambda: (copy(fixtures), newcli()))
+    bench.case('set', params, lambda state: quiet(state[0].do_set, 'bench.value 1 ' + state[1]), loaded)
+    bench.case('get', params, lambda state: quiet(state[0].do_get, '--tsv artist all'), loaded)
+
+    # A value that fits the header's slack is written in place; a longer one rewrites the files
+    bench.case('save', dict(params, mode='inplace'), lambda state: quiet(state[0].do_save, state[1]), lambda: inplace(*loaded(padding=64)))
+    bench.case('save', dict(params, mode='rewrite'), lambda state: quiet(state[0].do_save, state[1]), edited('x' * 256))
+
+    bench.case('lock', dict(params, cost=4), lambda state: quiet(state[0].do_lock, state[1]), loaded)
+    bench.case('load-locked', dict(params, cost=4), lambda state: quiet(state[1].do_load, state[0]), lambda: (copy(locked), newcli()))
+    bench.case('unlock', dict(params, cost=4), lambda state: quiet(state[0].do_unlock, state[1]), lambda: loaded(locked, unlockttl=0))
+
+    for directory in (fixtures, locked, work):
+        shutil.rmtree(directory, ignore_errors=True)
+
+def inplace(cli: Morlock.MorlockCli, paths: str):
+    'Save once with padding, then make a change that fits in it'
+
+    quiet(cli.do_set, 'bench 1 ' + paths)
+    quiet(cli.do_save, paths)
+    quiet(cli.do_set, 'bench 2 ' + paths)
+    return cli, paths
+
+def codeccases(bench: Benchmark, sizes: list[int]) -> None:
+    'Encode and decode synthetic headers with every codec'
+
+    for size in sizes:
+        header = content(size)
+        for name, flags in Morlock.CODECS.items():
+            payload = Morlock.encodepayload(header, flags)
+            params = {'codec': name, 'header': size, 'payload': len(payload)}
+            bench.case('encode', params, lambda _: Morlock.encodepayload(header, flags))
+            bench.case('decode', params, lambda _: Morlock.decodepayload(payload, flags))
+
+def memorycase(bench: Benchmark, root: str, count: int, headersize: int) -> None:
+    'Memory each loaded file keeps, measured with tracemalloc'
+
+    fixtures = os.path.join(root, 'memory-{}-{}'.format(count, headersize))
+    paths = ' '.join(makefiles(fixtures, 'mp3', count, 64 * 1024, headersize))
+
+    cli = newcli()
+    tracemalloc.start()
+    quiet(cli.do_load, paths)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        'name': 'memory',
+        'params': {'files': count, 'header': headersize},
+        'per_file_bytes': current // count,
+        'peak_bytes': peak
+    }
+    bench.results.append(result)
+
+    msg = '{:<12} {:<72} {:>12} B per file'.format('memory', json.dumps(result['params']), result['per_file_bytes'])
+    print(msg, file=sys.stderr)
+
+def registrycase(bench: Benchmark, root: str, count: int) -> None:
+    'Looking loaded files up by path in a registry of `count` files'
+
+    path = os.path.join(root, 'registry.mp3')
+    with open(path, 'wb') as f:
+        f.write(mp3audio(1024))
+
+    st = os.stat(path)
+    registry = Morlock.MorlockRegistry()
+    paths = [os.path.join(root, 'lib', '{:06d}.mp3'.format(i)) for i in range(count)]
+    for p in paths:
+        registry.add(Morlock.MorlockFile(p, 0, {'name': None, 'password': None, 'data': {}}, st))
+
+    probes = random.Random(0).sample(paths, min(count, 1000))
+    bench.case('registry', {'files': count, 'lookups': len(probes)}, lambda _: [registry.get(p) for p in probes])
+
+def startupcase(bench: Benchmark, budget: float) -> bool:
+    'Time to run a single `exec` command in a new interpreter; False when it is over `budget` seconds'
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    main = [sys.executable, os.path.join(here, 'main.py'), 'exec', 'quit']
+    bare = [sys.executable, '-c', 'pass']
+
+    result = bench.case('startup', {'command': 'exec quit'}, lambda _: subprocess.run(main, stdout=subprocess.DEVNULL, check=True), repeat=10)
+    bench.case('startup', {'command': 'python -c pass'}, lambda _: subprocess.run(bare, check=True), repeat=10)
+
+    if result['min_s'] > budget:
+        msg = 'Startup took {:.3f} s, over the budget of {:.3f} s.'.format(result['min_s'], budget)
+        print(msg, file=sys.stderr)
+        return False
+
+    return True
+
+def servercase(bench: Benchmark, root: str, clients: int, seconds: float) -> None:
+    'Sustained throughput of a local `serve` instance, each client working on its own file'
+
+    import socket, threading, urllib.request
+
+    paths = makefiles(os.path.join(root, 'server'), 'mp3', clients, 64 * 1024, 1024)
+
+    # Letting the OS pick a free port
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    daemon = subprocess.Popen([sys.executable, os.path.join(here, 'main.py'), 'serve', '--port', str(port), '--quiet'], stderr=subprocess.DEVNULL)
+    url = 'http://127.0.0.1:{}/'.format(port)
+
+    def post(op: str, body: dict) -> dict:
+        request = urllib.request.Request(url + op, json.dumps(body).encode('utf-8'))
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+
+    try:
+        for _ in range(100):
+            try:
+                post('load', {'paths': paths})
+                break
+            except OSError:
+                time.sleep(0.05)
+
+        for op, batch in (('get', 1), ('set', 1), ('get', 50), ('set', 50)):
+            counts = [0] * clients
+
+            def client(i: int) -> None:
+                body = {'op': op, 'key': 'artist', 'paths': [paths[i]]}
+                if op == 'set':
+                    body['value'] = 'client {}'.format(i)
+
+                endpoint, body = (op, body) if batch == 1 else ('batch', {'requests': [body] * batch})
+                deadline = time.perf_counter() + seconds
+
+                while time.perf_counter() < deadline:
+                    post(endpoint, body)
+                    counts[i] += 1
+
+            threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            result = {
+                'name': 'server',
+                'params': {'op': op, 'batch': batch, 'clients': clients},
+                'requests_per_s': sum(counts) / seconds,
+                'ops_per_s': sum(counts) * batch / seconds
+            }
+            bench.results.append(result)
+
+            msg = '{:<12} {:<72} {:>10.0f} req/s {:>10.0f} ops/s'.format('server', json.dumps(result['params']), result['requests_per_s'], result['ops_per_s'])
+            print(msg, file=sys.stderr)
+    finally:
+        daemon.terminate()
+        daemon.wait()
+
+def compare(results: list[dict], baseline: dict, threshold: float) -> int:
+    'Print how the fastest run of each case changed against `baseline`; returns how many got slower than allowed'
+
+    previous = {(r['name'], json.dumps(r['params'], sort_keys=True)): r for r in baseline['results']}
+    regressions = 0
+
+    for result in results:
+        old = previous.get((result['name'], json.dumps(result['params'], sort_keys=True)))
+        if old is None or not 'min_s' in result or not old.get('min_s'):
+            continue
+
+        ratio = result['min_s'] / old['min_s']
+        slower = ratio > 1 + threshold
+        regressions += slower
+
+        msg = '{:<12} {:<72} {:>6.2f}x{}'.format(result['name'], json.dumps(result['params']), ratio, '  REGRESSION' if slower else '')
+        print(msg, file=sys.stderr)
+
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=USAGE, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='small fixtures and few runs, for a smoke test')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown before a case counts as a regression (default 0.25)')
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET, help='seconds `main.py exec quit` may take (default {:g})'.format(STARTUP_BUDGET))
+    parser.add_argument('--only', nargs='+', choices=['commands', 'codecs', 'memory', 'registry', 'startup', 'server'], help='run only these groups')
+    args = parser.parse_args()
+
+    if args.quick:
+        repeat, count = 2, 10
+        shapes = [(kind, 64 * 1024, 1024) for kind in AUDIO]
+        codecsizes = [1024, 64 * 1024]
+        memory, registry, serving = (200, 1024), 10000, 0.5
+    else:
+        repeat, count = 3, 50
+        shapes = [(kind, audio, header) for kind in AUDIO for audio in (64 * 1024, 4 << 20) for header in (1024, 64 * 1024, 1 << 20)]
+        codecsizes = [1024, 64 * 1024, 1 << 20, 10 << 20, 50 << 20]
+        memory, registry, serving = (5000, 1024), 100000, 5
+
+    groups = set(args.only or ['commands', 'codecs', 'memory', 'registry', 'startup', 'server'])
+    bench = Benchmark(repeat)
+    root = tempfile.mkdtemp(prefix='morlock-bench-')
+    withinbudget = True
+
+    try:
+        if 'commands' in groups:
+            for kind, audio, header in shapes:
+                commandcases(bench, root, kind, count, audio, header)
+        if 'codecs' in groups:
+            codeccases(bench, codecsizes)
+        if 'memory' in groups:
+            memorycase(bench, root, *memory)
+        if 'registry' in groups:
+            registrycase(bench, root, registry)
+        if 'startup' in groups:
+            withinbudget = startupcase(bench, args.startup_budget)
+        if 'server' in groups:
+            servercase(bench, root, 4, serving)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'quick': args.quick,
+        'results': bench.results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        if compare(bench.results, baseline, args.threshold):
+            return 1
+
+    return 0 if withinbudget else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+import os, json, re, sqlite3
+from Morlock import compilekey, mapordered, readfile
+
+# Where the catalog lives unless `$MORLOCK_CATALOG` says otherwise
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.morlock.db')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS keys (
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (key, value, path)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS keys_path ON keys (path);
+'''
+
+TERM = re.compile(r'^(.+?)(==|!=)(.*)$')
+
+def flatten(value, key: str, rows: list) -> None:
+    'Append a `(key, value)` row for every leaf of `value`, keys written the way `set` takes them'
+
+    if isinstance(value, dict) and value:
+        for k, v in value.items():
+            flatten(v, key + '.' + k, rows)
+    elif isinstance(value, list) and value:
+        for i, v in enumerate(value):
+            flatten(v, '{}[{}]'.format(key, i), rows)
+    else:
+        rows.append((key, encodevalue(value)))
+
+def encodevalue(value) -> str:
+    'Values are stored and compared as compact JSON, so `1999` and `"1999"` differ'
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def scan(path: str) -> tuple[int, str, dict]:
+    """Read the header of a file without loading it. Returns
+    `(offset, status, content)`, status being one of `ok`, `locked` (content
+    is then None), `empty`, `corrupt` or `unreadable`.
+    """
+
+    try:
+        _, offset, _, _, content, _, _ = readfile(path)
+    except OSError:
+        return 0, 'unreadable', None
+    except ValueError:
+        return 0, 'corrupt', None
+
+    if content is None:
+        return 0, 'empty', None
+
+    # Locked headers are kept opaque
+    if content['password'] is not None:
+        return offset, 'locked', None
+
+    return offset, 'ok', content
+
+class MorlockCatalog:
+    'SQLite index of Morlock headers, queried without opening the audio files'
+
+    def __init__(self, path: str = None) -> None:
+        self.path = path or os.environ.get('MORLOCK_CATALOG') or DEFAULT_PATH
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def refresh(self, paths: list[str], dirs: list[tuple[str, bool]] = ()) -> tuple[int, int, int, list[str]]:
+        """Catalog given files, rescanning only those whose size or mtime
+        changed, or that couldn't be read last time. Catalogued files that
+        are gone, or that sit in one of `dirs` (`(directory, recursive)`
+        pairs) but weren't given, are removed. Returns how many files were
+        scanned, unchanged and removed, and the paths that couldn't be read.
+        """
+
+        known = {path: (size, mtime, status) for path, size, mtime, status in self.db.execute('SELECT path, size, mtime, status FROM files')}
+        changed = []
+        seen = set()
+        gone = []
+        unchanged = 0
+
+        for path in paths:
+            path = os.path.abspath(path)
+            if path in seen:
+                continue
+
+            seen.add(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                if path in known:
+                    gone.append(path)
+                continue
+
+            # Unreadable files are always retried: fixing their permissions doesn't change their mtime
+            entry = known.get(path)
+            if entry is None or entry[:2] != (st.st_size, st.st_mtime_ns) or entry[2] == 'unreadable':
+                changed.append((path, st.st_size, st.st_mtime_ns))
+            else:
+                unchanged += 1
+
+        for directory, recursive in dirs:
+            directory = os.path.join(os.path.abspath(directory), '')
+            for path in known:
+                if path in seen or not path.startswith(directory):
+                    continue
+
+                if recursive or os.path.dirname(path) == directory[:-1]:
+                    gone.append(path)
+
+        # Headers are read concurrently, then written in a single transaction
+        scans = mapordered(lambda item: scan(item[0]), changed)
+
+        with self.db:
+            self.db.executemany('DELETE FROM files WHERE path = ?', ((path,) for path in gone))
+            self.db.executemany('DELETE FROM keys WHERE path = ?', ((path,) for path in gone))
+            self.db.executemany('DELETE FROM keys WHERE path = ?', ((path,) for path, _, _ in changed))
+
+            for (path, size, mtime), (offset, status, content) in zip(changed, scans):
+                rows = []
+                name = None
+                if content is not None:
+                    name = content['name'] if isinstance(content['name'], str) else encodevalue(content['name'])
+                    flatten(content['name'], 'name', rows)
+                    flatten(content['data'], 'data', rows)
+
+                self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)', (path, size, mtime, offset, status, name))
+                self.db.executemany('INSERT OR IGNORE INTO keys VALUES (?, ?, ?)', ((key, value, path) for key, value in rows))
+
+        unreadable = [path for (path, _, _), (_, status, _) in zip(changed, scans) if status == 'unreadable']
+        return len(changed), unchanged, len(gone), unreadable
+
+    def paths(self) -> list[str]:
+        'Every catalogued path'
+        return [path for path, in self.db.execute('SELECT path FROM files ORDER BY path')]
+
+    def find(self, terms: list[str]) -> list[tuple[str, str, str]]:
+        """Return `(path, status, name)` of catalogued files matching all
+        terms: `key==value`, `key!=value` or a bare `key` that must exist.
+        Values are parsed as JSON when they can be, as strings otherwise.
+        Raises ValueError with a message for the user on invalid terms.
+        """
+
+        sql = 'SELECT path, status, name FROM files'
+        where = []
+        params = []
+
+        for term in terms:
+            match = TERM.match(term)
+            key, op, value = match.groups() if match else (term, None, None)
+
+            compilekey(key)
+            if op is None:
+                # The key itself or anything under it
+                where.append('path IN (SELECT path FROM keys WHERE key = ? OR key > ? AND key < ? OR key > ? AND key < ?)')
+                params += [key, key + '.', key + '/', key + '[', key + '\\']
+                continue
+
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+
+            if op == '==':
+                where.append('path IN (SELECT path FROM keys WHERE key = ? AND value = ?)')
+            else:
+                where.append("status = 'ok' AND path NOT IN (SELECT path FROM keys WHERE key = ? AND value = ?)")
+            params += [key, encodevalue(value)]
+
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+
+        return self.db.execute(sql + ' ORDER BY path', params).fetchall()
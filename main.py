@@ -1,7 +1,140 @@
-import Morlock
+import os, sys, shlex
 
-def main():
-    Morlock.MorlockCli().cmdloop()
+USAGE = '''usage: main.py [exec [options] COMMAND [ARGS...] [; COMMAND [ARGS...]]...]
+       main.py serve [--host HOST] [--port PORT | --socket PATH] [--padding N] [--quiet]
+
+Without arguments, starts the interactive shell. `exec` runs the given
+command(s) in order, without prompting, and exits. Commands are separated
+by a standalone `;` (quote it from the shell). `serve` keeps loaded files
+warm behind a JSON API on localhost (port 8765 by default) or on a Unix
+socket.
+
+options:
+  --name NAME             name given to files without Morlock content
+  --protect               password-protect files without Morlock content
+  --password PASSWORD     password of locked files (or $MORLOCK_PASSWORD)
+  --password-stdin        read the password of locked files from stdin
+  --new-password PASSWORD password set by `lock` (or $MORLOCK_NEW_PASSWORD)
+  --yes                   discard unsaved changes when asked
+
+Setting $MORLOCK_TRACE to a file turns `stats` on and appends every timed
+phase to that file as a JSON line.
+'''
+
+def execute(argv: list[str]) -> int:
+    'Run `exec` arguments non-interactively'
+
+    import Morlock
+
+    answers = {}
+    if 'MORLOCK_PASSWORD' in os.environ:
+        answers['password'] = os.environ['MORLOCK_PASSWORD']
+    if 'MORLOCK_NEW_PASSWORD' in os.environ:
+        answers['newpassword'] = os.environ['MORLOCK_NEW_PASSWORD']
+
+    # Parsing options until the first command
+    options = { '--name': 'name', '--password': 'password', '--new-password': 'newpassword' }
+    while argv and argv[0].startswith('--'):
+        option, argv = argv[0], argv[1:]
+
+        if option in options and argv:
+            answers[options[option]], argv = argv[0], argv[1:]
+        elif option == '--password-stdin':
+            answers['password'] = sys.stdin.readline().rstrip('\n')
+        elif option == '--protect':
+            answers['protect'] = 'y'
+        elif option == '--yes':
+            answers['discard'] = 'y'
+        else:
+            print(USAGE, file=sys.stderr)
+            return 2
+
+    if not argv:
+        print(USAGE, file=sys.stderr)
+        return 2
+
+    # Splitting commands on standalone `;`
+    lines, line = [], []
+    for arg in argv + [';']:
+        if arg == ';':
+            if line:
+                lines.append(line)
+            line = []
+        else:
+            line.append(arg)
+
+    cli = Morlock.MorlockCli()
+    cli.answers = answers
+    cli.interactive = False
+
+    # Every command is checked before any runs, so a typo can't stop a chain halfway
+    for line in lines:
+        if getattr(cli, 'do_' + line[0], None) is None:
+            msg = "Unknown command '{}'.".format(line[0])
+            print(msg, file=sys.stderr)
+            return 2
+
+    quit = False
+    try:
+        for line in lines:
+            if cli.execute(line[0] + ' ' + shlex.join(line[1:])):
+                quit = True
+                break
+    finally:
+        # Files still queued by write-back `save` must reach the disk; quitting flushed them
+        if not quit:
+            cli.do_flush()
+
+    return 0
+
+def serve(argv: list[str]) -> int:
+    'Run the `serve` daemon until interrupted'
+
+    options = {'--host': 'host', '--port': 'port', '--socket': 'socket', '--padding': 'padding'}
+    kwargs = {}
+
+    while argv:
+        option, argv = argv[0], argv[1:]
+
+        if option in options and argv:
+            kwargs[options[option]], argv = argv[0], argv[1:]
+        elif option == '--quiet':
+            kwargs['quiet'] = True
+        else:
+            print(USAGE, file=sys.stderr)
+            return 2
+
+    for name in ('port', 'padding'):
+        if name in kwargs:
+            if not kwargs[name].isdecimal():
+                print(USAGE, file=sys.stderr)
+                return 2
+
+            kwargs[name] = int(kwargs[name])
+
+    import server
+    server.serve(**kwargs)
+    return 0
+
+def main() -> int:
+    argv = sys.argv[1:]
+
+    # Tracing phases from the very first command, like `stats trace FILE`
+    if os.environ.get('MORLOCK_TRACE'):
+        import Morlock
+        Morlock.STATS.enable(os.environ['MORLOCK_TRACE'])
+
+    if argv[:1] == ['exec']:
+        return execute(argv[1:])
+    elif argv[:1] == ['serve']:
+        return serve(argv[1:])
+    elif argv:
+        print(USAGE, file=sys.stderr)
+        return 2
+
+    import shell
+    shell.MorlockShell().cmdloop()
+    return 0
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())
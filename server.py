@@ -0,0 +1,280 @@
+import os, copy, json, threading
+from werkzeug.wrappers import Request, Response
+from werkzeug.exceptions import HTTPException, BadRequest, NotFound
+from Morlock import CONTAINERS, DEFAULT, MorlockCli, MorlockEmpty, MorlockFile, MorlockRegistry, STATS, checkpassword, compilekey, lookup, readfile, setkey
+
+class MorlockService:
+    """A warm registry of MorlockFiles shared by every client. Each file has
+    its own lock, so clients working on different files run in parallel
+    while changes to the same file are serialized.
+    """
+
+    def __init__(self, padding: int = 0) -> None:
+        self.registry = MorlockRegistry()
+        self.padding = padding
+        self.lock = threading.Lock()
+        self.locks: dict[str, threading.Lock] = {}
+
+    def filelock(self, path: str) -> threading.Lock:
+        with self.lock:
+            return self.locks.setdefault(MorlockRegistry.key(path), threading.Lock())
+
+    def find(self, path: str) -> MorlockFile:
+        with self.lock:
+            return self.registry.get(path)
+
+    def paths(self, request: dict) -> list[str]:
+        'Paths a request is about: `paths`, or every loaded file for `"all"`'
+
+        paths = request.get('paths', [])
+        if paths == 'all':
+            with self.lock:
+                return [morlockfile.path for morlockfile in self.registry]
+
+        if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            raise ValueError('`paths` must be a list of paths or "all".')
+
+        return paths
+
+    def steps(self, request: dict) -> tuple:
+        'The compiled `key` of a request'
+
+        key = request.get('key', '')
+        if not isinstance(key, str):
+            raise ValueError('`key` must be a string.')
+
+        return compilekey(key)
+
+    def load(self, request: dict) -> list[dict]:
+        """Load files not loaded yet. Locked files need `password`; files
+        without Morlock content get the defaults, named after `name`.
+        """
+
+        results = []
+        for path in self.paths(request):
+            with self.filelock(path):
+                results.append(self.loadone(path, request))
+
+        return results
+
+    def loadone(self, path: str, request: dict) -> dict:
+        if self.find(path) is not None:
+            return {'path': path, 'loaded': True}
+
+        if not os.path.isfile(path):
+            return {'path': path, 'error': 'not found'}
+
+        if not MorlockCli.extension(path) in CONTAINERS:
+            return {'path': path, 'error': 'extension not supported'}
+
+        try:
+            st, offset, version, flags, content, digest, bytesread = readfile(path, lazy=True)
+        except OSError as e:
+            return {'path': path, 'error': e.strerror or str(e)}
+        except ValueError:
+            return {'path': path, 'error': 'possibly corrupted'}
+
+        empty = content is None
+        if empty:
+            content = copy.deepcopy(DEFAULT)
+            content['name'] = request.get('name')
+
+        if content['password'] is not None:
+            with STATS.phase('password.check'):
+                match = checkpassword((request.get('password') or '', content['password']))
+
+            if not match:
+                return {'path': path, 'error': 'incorrect password'}
+
+        morlockfile = MorlockFile(path, offset, content, st)
+        morlockfile.version = version
+        morlockfile.codec = flags
+        morlockfile.digest = digest
+
+        with self.lock:
+            self.registry.add(morlockfile)
+            morlockfile.modified = empty
+
+        return {'path': path, 'loaded': True, 'bytes': bytesread}
+
+    def get(self, request: dict) -> list[dict]:
+        'Read `key` (in `set` syntax) from each file; `missing` marks files without it'
+
+        steps = self.steps(request)
+        results = []
+
+        for path in self.paths(request):
+            with self.filelock(path):
+                morlockfile = self.find(path)
+                if morlockfile is None:
+                    results.append({'path': path, 'error': 'not loaded'})
+                    continue
+
+                # Copied while locked: the response is written after other clients may change it
+                value = copy.deepcopy(lookup(morlockfile.content, steps))
+
+            if value is MorlockEmpty:
+                results.append({'path': path, 'missing': True})
+            else:
+                results.append({'path': path, 'value': value})
+
+        return results
+
+    def set(self, request: dict) -> list[dict]:
+        'Set `key` to `value` in each file'
+
+        steps = self.steps(request)
+        if not 'value' in request:
+            raise ValueError('A value must be provided.')
+
+        results = []
+        for path in self.paths(request):
+            with self.filelock(path):
+                morlockfile = self.find(path)
+                if morlockfile is None:
+                    results.append({'path': path, 'error': 'not loaded'})
+                    continue
+
+                try:
+                    with STATS.phase('set.apply', path):
+                        changed = setkey(morlockfile.content['data'], steps, copy.deepcopy(request['value']))
+                except IndexError as e:
+                    results.append({'path': path, 'error': str(e)})
+                    continue
+
+                if changed:
+                    with self.lock:
+                        morlockfile.modified = True
+
+            results.append({'path': path, 'changed': changed})
+
+        return results
+
+    def save(self, request: dict) -> list[dict]:
+        'Write modified files to disk'
+
+        results = []
+        for path in self.paths(request):
+            with self.filelock(path):
+                morlockfile = self.find(path)
+                if morlockfile is None:
+                    results.append({'path': path, 'error': 'not loaded'})
+                    continue
+
+                if not morlockfile.modified:
+                    results.append({'path': path, 'saved': False})
+                    continue
+
+                # Files whose header didn't really change aren't written
+                try:
+                    saved = morlockfile.write(self.padding)
+                except OSError as e:
+                    results.append({'path': path, 'error': str(e)})
+                    continue
+
+                with self.lock:
+                    morlockfile.modified = False
+
+            results.append({'path': path, 'saved': saved})
+
+        return results
+
+    def unload(self, request: dict) -> list[dict]:
+        'Unload files; ones with unsaved changes only with `"discard": true`'
+
+        results = []
+        for path in self.paths(request):
+            with self.filelock(path):
+                morlockfile = self.find(path)
+                if morlockfile is None:
+                    results.append({'path': path, 'error': 'not loaded'})
+                    continue
+
+                if morlockfile.modified and request.get('discard') is not True:
+                    results.append({'path': path, 'error': 'unsaved changes'})
+                    continue
+
+                with self.lock:
+                    self.registry.remove(morlockfile)
+
+            results.append({'path': path, 'unloaded': True})
+
+        return results
+
+    def files(self, request: dict) -> list[dict]:
+        'Every loaded file and whether it has unsaved changes'
+
+        with self.lock:
+            return [{'path': morlockfile.path, 'modified': morlockfile.modified} for morlockfile in self.registry]
+
+    def batch(self, request: dict) -> list:
+        'Run `requests` (each with an `op`) in order; an invalid one gives its error without stopping the rest'
+
+        requests = request.get('requests')
+        if not isinstance(requests, list):
+            raise ValueError('`requests` must be a list.')
+
+        results = []
+        for item in requests:
+            op = self.operation(item.get('op') if isinstance(item, dict) else None)
+            if op is None or op == self.batch:
+                results.append({'error': 'unknown op'})
+                continue
+
+            try:
+                results.append(op(item))
+            except (ValueError, TypeError) as e:
+                results.append({'error': str(e)})
+
+        return results
+
+    def operation(self, name: str):
+        if name in ('load', 'get', 'set', 'save', 'unload', 'files', 'batch'):
+            return getattr(self, name)
+
+        return None
+
+    def __call__(self, environ, start_response):
+        'WSGI entry point: `POST /<op>` with a JSON object, answered with `{"results": [...]}`'
+
+        request = Request(environ)
+
+        try:
+            op = self.operation(request.path.strip('/'))
+            if op is None:
+                raise NotFound()
+
+            if request.method == 'GET' and op == self.files:
+                body = {}
+            else:
+                body = request.get_json(force=True, silent=True)
+                if not isinstance(body, dict):
+                    raise BadRequest('The body must be a JSON object.')
+
+            try:
+                response = {'results': op(body)}
+            except ValueError as e:
+                raise BadRequest(str(e))
+        except HTTPException as e:
+            response = Response(json.dumps({'error': e.description}), e.code, mimetype='application/json')
+            return response(environ, start_response)
+
+        response = Response(json.dumps(response, ensure_ascii=False), mimetype='application/json')
+        return response(environ, start_response)
+
+def serve(host: str = '127.0.0.1', port: int = 8765, socket: str = None, padding: int = 0, quiet: bool = False) -> None:
+    'Serve a MorlockService over localhost HTTP, or over a Unix socket when `socket` is given'
+
+    from werkzeug.serving import run_simple
+
+    service = MorlockService(padding)
+
+    # Logging every request costs more than most requests themselves
+    if quiet:
+        import logging
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    if socket is not None:
+        run_simple('unix://' + socket, 0, service, threaded=True)
+    else:
+        run_simple(host, port, service, threaded=True)
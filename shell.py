@@ -0,0 +1,12 @@
+import cmd
+from Morlock import MorlockCli
+
+class MorlockShell(cmd.Cmd, MorlockCli):
+    'Interactive REPL over the Morlock commands'
+
+    intro = MorlockCli.intro
+    prompt = MorlockCli.prompt
+
+    def __init__(self) -> None:
+        cmd.Cmd.__init__(self)
+        MorlockCli.__init__(self)
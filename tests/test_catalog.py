@@ -0,0 +1,40 @@
+import catalog
+import Morlock
+
+AUDIO = b'ID3\x04\x00\x00\x00\x00\x00\x10' + bytes(16) + b'\xff\xfb\x90\x64' + bytes(64)
+
+def makefile(path, data: dict = None) -> str:
+    path.write_bytes(AUDIO)
+    if data is not None:
+        Morlock.MorlockFile(str(path), 0, {'name': path.stem, 'password': None, 'data': data}).write()
+
+    return str(path)
+
+def test_refresh(tmp_path):
+    db = catalog.MorlockCatalog(str(tmp_path / 'catalog.db'))
+    paths = [makefile(tmp_path / 'a.mp3', {'artist': 'X'}), makefile(tmp_path / 'b.mp3')]
+
+    assert db.refresh(paths) == (2, 0, 0, [])
+    assert db.refresh(paths) == (0, 2, 0, [])
+    assert [row[:2] for row in db.find(['data.artist=="X"'])] == [(paths[0], 'ok')]
+    assert [row[:2] for row in db.find([])] == [(paths[0], 'ok'), (paths[1], 'empty')]
+
+def test_refresh_unreadable(tmp_path, monkeypatch):
+    db = catalog.MorlockCatalog(str(tmp_path / 'catalog.db'))
+    paths = [makefile(tmp_path / 'a.mp3', {'artist': 'X'}), makefile(tmp_path / 'b.mp3', {'artist': 'Y'})]
+    readfile = catalog.readfile
+
+    def denied(path: str, *args, **kwargs):
+        if path == paths[0]:
+            raise PermissionError(13, 'Permission denied', path)
+        return readfile(path, *args, **kwargs)
+
+    # One unreadable file doesn't stop the others from being catalogued
+    monkeypatch.setattr(catalog, 'readfile', denied)
+    assert db.refresh(paths) == (2, 0, 0, [paths[0]])
+    assert [row[:2] for row in db.find([])] == [(paths[0], 'unreadable'), (paths[1], 'ok')]
+
+    # It's read again once it can be, though it didn't change
+    monkeypatch.setattr(catalog, 'readfile', readfile)
+    assert db.refresh(paths) == (1, 1, 0, [])
+    assert [row[:2] for row in db.find(['data.artist=="X"'])] == [(paths[0], 'ok')]
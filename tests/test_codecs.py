@@ -0,0 +1,179 @@
+import json, zlib
+import pytest
+import Morlock
+
+CONTENT = {
+    'name': 'track',
+    'password': None,
+    'data': {
+        'artist': 'Ünïcødé ✓',
+        'year': 1999,
+        'rating': 4.5,
+        'live': True,
+        'remix': False,
+        'label': None,
+        'big': [2**31, -2**31 - 1, 2**63 - 1, -2**63, 2**63, -2**63 - 1, 10**40],
+        'tags': ['a', 'b', 'c', 'd', 'e'],
+        'empty': {'list': [], 'dict': {}, 'string': ''},
+        'cues': [{'t': 1.5, 'label': 'intro'}, {'t': 30.25, 'label': 'drop', 'ids': [1, 2, 3, 4]}],
+        'waveform': [0, -3, 127, -128, 5, 6],
+        'floats': [0.0, -1.5, 1e300, 2.5e-300]
+    }
+}
+
+def encode(value) -> bytes:
+    out = bytearray()
+    Morlock.encodebinary(value, out)
+    return bytes(out)
+
+def same(a, b) -> bool:
+    'Equal, and of the same JSON types (1 == 1.0 == True otherwise)'
+
+    if a is Morlock.MorlockEmpty or b is Morlock.MorlockEmpty:
+        return a is b
+
+    return json.dumps(a, sort_keys=True) == json.dumps(b, sort_keys=True)
+
+@pytest.mark.parametrize('codec', Morlock.CODECS)
+@pytest.mark.parametrize('lazy', [False, True])
+def test_roundtrip(codec, lazy):
+    flags = Morlock.CODECS[codec]
+    payload = Morlock.encodepayload(CONTENT, flags)
+    assert same(Morlock.decodepayload(payload, flags, lazy), CONTENT)
+
+    if flags & Morlock.FLAG_ZLIB:
+        assert zlib.decompress(payload) == Morlock.encodepayload(CONTENT, flags & ~Morlock.FLAG_ZLIB)
+
+@pytest.mark.parametrize('values, typecode', [
+    ([-128, 127, 0, 1], b'b'),
+    ([-129, 0, 0, 0], b'h'),
+    ([0, 0, 0, 128], b'h'),
+    ([-2**15, 2**15 - 1, 0, 0], b'h'),
+    ([-2**15 - 1, 0, 0, 0], b'i'),
+    ([0, 0, 0, 2**15], b'i'),
+    ([-2**31, 2**31 - 1, 0, 0], b'i'),
+    ([-2**31 - 1, 0, 0, 0], b'q'),
+    ([0, 0, 0, 2**31], b'q'),
+    ([-2**63, 2**63 - 1, 0, 0], b'q'),
+    ([0.5, -1.0, 0.0, 3.25], b'd')
+])
+def test_packed_arrays(values, typecode):
+    raw = encode(values)
+    assert raw[:2] == b'A' + typecode
+    assert same(Morlock.decodebinary(memoryview(raw))[0], values)
+
+@pytest.mark.parametrize('values', [
+    [0, 1, 2],
+    [0, 0, 0, 2**63],
+    [0, 0, 0, -2**63 - 1],
+    [1, 2.0, 3, 4],
+    [1.0, 2.0, 3.0, 4],
+    [True, 1, 2, 3],
+    [1, 2, 3, None],
+    [1, 2, 3, '4']
+])
+def test_unpacked_lists(values):
+    # Too short, out of every array's range, or mixed: kept item by item
+    raw = encode(values)
+    assert raw[:1] == b'l'
+    assert same(Morlock.decodebinary(memoryview(raw))[0], values)
+
+@pytest.mark.parametrize('size, tag', [(0, b'S'), (255, b'S'), (256, b's'), (70000, b's')])
+def test_long_strings(size, tag):
+    value = 'x' * size
+    raw = encode(value)
+    assert raw[:1] == tag
+    assert Morlock.decodebinary(memoryview(raw)) == (value, len(raw))
+
+    # Sizes are in bytes, not characters
+    value = 'é' * size
+    assert Morlock.decodebinary(memoryview(encode(value)))[0] == value
+
+@pytest.mark.parametrize('size', [0, 1, 254, 255, 256, 1000])
+def test_long_keys(size):
+    value = {'k' * size: 1, 'é' * size: [1, 2], 'last': 'x'}
+    raw = encode(value)
+    assert Morlock.decodebinary(memoryview(raw)) == (value, len(raw))
+    assert Morlock.skipbinary(memoryview(raw)) == len(raw)
+    assert Morlock.seekbinary(memoryview(raw), ('é' * size, 1)) == 2
+    assert Morlock.seekbinary(memoryview(raw), ('last',)) == 'x'
+
+def test_skip_and_seek():
+    raw = memoryview(encode(CONTENT['data']))
+    assert Morlock.skipbinary(raw) == len(raw)
+
+    for key in ('artist', 'year', 'big[2]', 'big[6]', 'cues[1].label', 'cues[1].ids[3]', 'waveform[5]', 'floats[2]', 'empty.dict', 'missing', 'tags[5]', 'cues[0].t.x', 'waveform[0].x', 'artist[0]'):
+        steps = Morlock.compilekey(key)
+        assert same(Morlock.seekbinary(raw, steps), Morlock.getkey(CONTENT['data'], steps)), key
+
+@pytest.mark.parametrize('codec', Morlock.CODECS)
+@pytest.mark.parametrize('lazy', [False, True])
+def test_truncated(codec, lazy):
+    flags = Morlock.CODECS[codec]
+    payload = Morlock.encodepayload(CONTENT, flags)
+
+    for size in range(len(payload)):
+        assert Morlock.decodepayload(payload[:size], flags, lazy) is None, size
+
+def corruptions(payload: bytes) -> tuple[list[bytes], list[bytes]]:
+    'Corrupted copies of a binary payload: damage outside `data`, and inside it'
+
+    tag = payload.index(b'S\x05track')
+    array = payload.index(b'Ab')
+    text = payload.index('Ü'.encode('utf-8'))
+
+    outside = [
+        # Trailing bytes
+        payload + b'N',
+        # An unknown tag, where `name`'s value starts
+        payload[:tag] + b'?' + payload[tag + 1:],
+        # A container claiming more items than bytes
+        payload[:1] + Morlock.SIZED.pack(len(payload), len(payload) - 9) + payload[9:]
+    ]
+    inside = [
+        # An array with an unknown type code
+        payload[:array] + b'Az' + payload[array + 2:],
+        # Invalid UTF-8 in a string
+        payload[:text] + b'\xff' + payload[text + 1:]
+    ]
+
+    return outside, inside
+
+def test_corrupted():
+    outside, inside = corruptions(Morlock.encodepayload(CONTENT, Morlock.FLAG_BINARY))
+    for payload in outside + inside:
+        assert Morlock.decodepayload(payload, Morlock.FLAG_BINARY) is None
+
+    assert Morlock.decodepayload(b'not zlib', Morlock.FLAG_ZLIB) is None
+    assert Morlock.decodepayload(b'{"name": ', 0) is None
+
+def test_corrupted_lazy():
+    # Lazy content only checks the bounds of `data` (the frame's CRC guards the rest), so damage inside it shows on access
+    outside, inside = corruptions(Morlock.encodepayload(CONTENT, Morlock.FLAG_BINARY))
+    for payload in outside:
+        assert Morlock.decodepayload(payload, Morlock.FLAG_BINARY, lazy=True) is None
+
+    for payload in inside:
+        content = Morlock.decodepayload(payload, Morlock.FLAG_BINARY, lazy=True)
+        assert content['name'] == 'track'
+        with pytest.raises(ValueError):
+            content['data']
+
+@pytest.mark.parametrize('flags', [0x02, 0x04, 0x20, 0x80, 0x03, 0xff])
+def test_unknown_flags(flags):
+    # Payloads from a newer Morlock aren't guessed at
+    for codec in Morlock.CODECS.values():
+        assert Morlock.decodepayload(Morlock.encodepayload(CONTENT, codec), flags | codec) is None
+
+def test_framed_header(tmp_path):
+    path = tmp_path / 'track.mp3'
+    path.write_bytes(b'ID3\x04\x00\x00\x00\x00\x00\x10' + bytes(16) + b'\xff\xfb\x90\x64')
+
+    for codec in Morlock.CODECS.values():
+        morlockfile = Morlock.MorlockFile(str(path), 0, json.loads(json.dumps(CONTENT)))
+        morlockfile.codec = codec
+        morlockfile.write()
+
+        st, offset, version, flags, content, digest, bytesread = Morlock.readfile(str(path))
+        assert flags == codec and same(content, CONTENT)
+        path.write_bytes(path.read_bytes()[offset:])
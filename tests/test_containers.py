@@ -0,0 +1,107 @@
+import io, json
+import Morlock
+
+# Smallest streams each container parser has to recognise, zeros standing in for the audio
+def id3(size: int = 32, flags: int = 0) -> bytes:
+    'An ID3v2.4 tag of `size` bytes (plus a footer when flags has 0x10)'
+
+    syncsafe = bytes([(size >> 21) & 0x7f, (size >> 14) & 0x7f, (size >> 7) & 0x7f, size & 0x7f])
+    footer = b'3DI\x04\x00' + bytes([flags]) + syncsafe if flags & 0x10 else b''
+    return b'ID3\x04\x00' + bytes([flags]) + syncsafe + bytes(size) + footer
+
+def oggpage(kind: int = 0x02, segments: int = 1) -> bytes:
+    'An Ogg page of header type `kind` with `segments` lacing values of 30'
+    return b'OggS\x00' + bytes([kind]) + bytes(20) + bytes([segments]) + bytes([30] * segments) + bytes(30 * segments)
+
+def flacblock(kind: int, size: int, last: bool = False) -> bytes:
+    'A FLAC metadata block header and a body of `size` zeros'
+    return bytes([kind | (0x80 if last else 0)]) + size.to_bytes(3, 'big') + bytes(size)
+
+def riffchunk(name: bytes, size: int) -> bytes:
+    'A RIFF chunk with its pad byte when `size` is odd'
+    return name + size.to_bytes(4, 'little') + bytes(size + (size & 1))
+
+def parse(kind: str, data: bytes, offset: int = 0) -> int:
+    return Morlock.CONTAINERS[kind].parse(io.BytesIO(data), offset)
+
+def test_mp3_id3():
+    assert parse('mp3', id3(32) + b'\xff\xfb\x90\x64') == 10 + 32
+
+def test_mp3_id3_footer():
+    # The footer is 10 bytes the tag size doesn't count
+    assert parse('mp3', id3(32, flags=0x10) + b'\xff\xfb\x90\x64') == 10 + 32 + 10
+
+def test_mp3_id3_invalid():
+    tag = bytearray(id3(32))
+    tag[6] = 0x80
+    assert parse('mp3', bytes(tag)) is None
+    assert parse('mp3', b'ID3\x05\x00\x00' + bytes(4)) is None
+
+def test_mp3_frame():
+    assert parse('mp3', bytes(3) + b'\xff\xfb\x90\x64', 3) == 3
+    # Reserved bitrate
+    assert parse('mp3', b'\xff\xfb\xf0\x64') is None
+
+def test_ogg_bos():
+    assert parse('ogg', oggpage(0x02, 2)) == 27 + 2
+    assert parse('ogg', bytes(5) + oggpage(0x02), 5) == 5 + 27 + 1
+
+def test_ogg_not_bos():
+    # Continuation and end-of-stream pages can't open a stream
+    assert parse('ogg', oggpage(0x01)) is None
+    assert parse('ogg', oggpage(0x04)) is None
+    assert parse('ogg', oggpage(0x0a)) is None
+
+def test_ogg_truncated():
+    assert parse('ogg', oggpage(0x02, 3)[:28]) is None
+
+def test_flac_block_walk():
+    stream = b'fLaC' + flacblock(0, 34) + flacblock(4, 100) + flacblock(1, 7, last=True)
+    assert parse('flac', stream + b'\xff\xf8') == len(stream)
+
+def test_flac_streaminfo_only():
+    stream = b'fLaC' + flacblock(0, 34, last=True)
+    assert parse('flac', stream) == len(stream)
+
+def test_flac_invalid():
+    # STREAMINFO must come first and be 34 bytes
+    assert parse('flac', b'fLaC' + flacblock(1, 34, last=True)) is None
+    assert parse('flac', b'fLaC' + flacblock(0, 33, last=True)) is None
+    assert parse('flac', b'fLaC' + flacblock(0, 34) + bytes([0x7f]) + bytes(3)) is None
+    # No last block before the end of the file
+    assert parse('flac', b'fLaC' + flacblock(0, 34)) is None
+
+def test_wav_chunk_walk():
+    # `LIST` has an odd size, so a pad byte follows it
+    stream = b'RIFF' + bytes(4) + b'WAVE' + riffchunk(b'fmt ', 16) + riffchunk(b'LIST', 7)
+    assert parse('wav', stream + b'data' + bytes(4) + bytes(8)) == len(stream) + 8
+
+def test_wav_invalid():
+    assert parse('wav', b'RIFF' + bytes(4) + b'AVI ' + riffchunk(b'data', 8)) is None
+    # No `data` chunk
+    assert parse('wav', b'RIFF' + bytes(4) + b'WAVE' + riffchunk(b'fmt ', 16)) is None
+
+AUDIO = {
+    'mp3': id3(32, flags=0x10) + b'\xff\xfb\x90\x64' + bytes(64),
+    'ogg': oggpage(0x02) + oggpage(0x00),
+    'flac': b'fLaC' + flacblock(0, 34, last=True) + b'\xff\xf8' + bytes(64),
+    'wav': b'RIFF' + bytes(4) + b'WAVE' + riffchunk(b'fmt ', 16) + riffchunk(b'data', 64)
+}
+
+def test_readheader(tmp_path):
+    'A tag-delimited header ends where each format recognises its audio'
+
+    text = json.dumps({'name': 'x', 'password': None, 'data': {'a': 1}}).encode('utf-8')
+    for kind, audio in AUDIO.items():
+        path = tmp_path / ('track.' + kind)
+        path.write_bytes(b'<morlock>' + text + b'</morlock>' + audio)
+
+        head, header, bytesread, version, flags = Morlock.readheader(str(path), Morlock.CONTAINERS[kind])
+        assert header == (9, 9 + len(text), 9 + len(text) + 10), kind
+        assert Morlock.extractjson(head[header[0]:header[1]])['data'] == {'a': 1}
+
+def test_readheader_bare_audio(tmp_path):
+    for kind, audio in AUDIO.items():
+        path = tmp_path / ('track.' + kind)
+        path.write_bytes(audio)
+        assert Morlock.readheader(str(path), Morlock.CONTAINERS[kind])[1] is None, kind
@@ -0,0 +1,113 @@
+import copy, json
+import pytest
+import Morlock
+
+AUDIO = b'ID3\x04\x00\x00\x00\x00\x00\x10' + bytes(16) + b'\xff\xfb\x90\x64' + bytes(64)
+DATA = {
+    'artist': 'X',
+    'year': 1999,
+    'tags': ['a', 'b', 'c', 'd'],
+    'cues': [{'t': 1.5, 'label': 'intro'}, {'t': 30.25, 'label': 'drop', 'ids': [1, 2, 3, 4]}],
+    'waveform': list(range(-300, 300)),
+    'k' * 300: {'deep': [None, True, False, 2**40]}
+}
+KEYS = ['artist', 'year', 'tags[3]', 'tags[4]', 'cues[1].ids[2]', 'cues[0].label', 'cues[0].missing', 'waveform[599]', 'waveform[600]',
+        'waveform[0].x', 'k' * 300 + '.deep[3]', 'artist.x', 'missing', 'cues.x']
+
+def lazycontent(data: dict = DATA) -> Morlock.MorlockContent:
+    content = {'name': 'track', 'password': None, 'data': copy.deepcopy(data)}
+    content = Morlock.decodepayload(Morlock.encodepayload(content, Morlock.FLAG_BINARY), Morlock.FLAG_BINARY, lazy=True)
+    assert content.lazy
+    return content
+
+def same(a, b) -> bool:
+    return a is b if Morlock.MorlockEmpty in (a, b) else a == b
+
+def payload(path) -> bytes:
+    'The payload of the framed header on disk'
+    head, (start, end, _), _, _, _ = Morlock.readheader(str(path), Morlock.CONTAINERS['mp3'])
+    return bytes(head[start:end])
+
+@pytest.mark.parametrize('codec', ['binary', 'binary+zlib'])
+def test_lock_keeps_data_bytes(tmp_path, codec):
+    path = tmp_path / 'track.mp3'
+    path.write_bytes(AUDIO)
+    morlockfile = Morlock.MorlockFile(str(path), 0, {'name': 'track', 'password': None, 'data': copy.deepcopy(DATA)})
+    morlockfile.codec = Morlock.CODECS[codec]
+    morlockfile.write()
+    raw = Morlock.readfile(str(path), lazy=True)[4].raw
+
+    cli = Morlock.MorlockCli()
+    cli.interactive = False
+    cli.answers = {'password': 'secret', 'newpassword': 'secret'}
+    cli.cost = 4
+    cli.execute('load ' + str(path))
+    cli.execute('lock ' + str(path))
+    morlockfile = cli.loadedfiles.get(str(path))
+    assert morlockfile.content.lazy and morlockfile.modified
+    cli.execute('save ' + str(path))
+
+    # `data` went back byte for byte, and the spliced payload is the one a fresh encoding gives
+    flags = Morlock.CODECS[codec]
+    content = Morlock.readfile(str(path), lazy=True)[4]
+    assert content.raw == raw and content['password'] is not None
+    expected = {'name': 'track', 'password': content['password'], 'data': DATA}
+    assert payload(path) == Morlock.encodepayload(expected, flags)
+    assert Morlock.decodepayload(payload(path), flags) == expected
+    assert path.read_bytes().endswith(AUDIO)
+
+def test_splice_after_other_changes():
+    content = lazycontent()
+    content['name'] = 'n' * 300
+    content['extra'] = [1, 2]
+    del content['password']
+
+    spliced = Morlock.encodepayload(content, Morlock.FLAG_BINARY)
+    assert content.lazy
+    assert Morlock.decodepayload(spliced, Morlock.FLAG_BINARY) == {'name': 'n' * 300, 'extra': [1, 2], 'data': DATA}
+
+def test_lookup_matches_getkey():
+    content = lazycontent()
+    for key in KEYS:
+        steps = Morlock.compilekey(key)
+        assert same(Morlock.lookup(content, steps), Morlock.getkey(DATA, steps)), key
+        assert content.lazy
+
+    # Once decoded, lookup goes through `data` itself
+    content.materialize()
+    for key in KEYS:
+        steps = Morlock.compilekey(key)
+        assert same(Morlock.lookup(content, steps), Morlock.getkey(DATA, steps)), key
+
+def test_mapping():
+    content = lazycontent()
+    assert len(content) == 3 and 'data' in content and content.lazy
+    assert content.get('name') == 'track' and content.get('nope', 1) == 1 and content.lazy
+
+    expected = {'name': 'track', 'password': None, 'data': DATA}
+    assert lazycontent() == expected
+    assert not lazycontent() != expected
+    assert expected == lazycontent()
+    assert lazycontent() != {'name': 'track', 'password': None, 'data': {}}
+    assert list(lazycontent()) == ['name', 'password', 'data']
+    assert dict(lazycontent().items()) == expected
+    assert json.loads(json.dumps(lazycontent())) == expected
+    assert repr(lazycontent()) == repr(expected)
+
+def test_copies():
+    content = lazycontent()
+    copied = copy.deepcopy(content)
+    assert copied == {'name': 'track', 'password': None, 'data': DATA}
+
+    # Copies don't share `data` with the original
+    copied['data']['artist'] = 'Y'
+    assert content['data']['artist'] == 'X'
+
+    content = lazycontent()
+    assert content.copy() == {'name': 'track', 'password': None, 'data': DATA} and not content.lazy
+
+def test_setting_data():
+    content = lazycontent()
+    content['data'] = {'a': 1}
+    assert not content.lazy and content['data'] == {'a': 1}
+    assert Morlock.decodepayload(Morlock.encodepayload(content, Morlock.FLAG_BINARY), Morlock.FLAG_BINARY)['data'] == {'a': 1}
@@ -0,0 +1,97 @@
+import json
+import pytest
+import Morlock
+
+# Regression corpus of tag-delimited headers the original byte-by-byte loader accepted
+AUDIO = b'ID3\x04\x00\x00\x00\x00\x00\x10' + bytes(16) + b'\xff\xfb\x90\x64' + bytes(8)
+CONTENT = {'name': 'track', 'password': None, 'data': {'artist': 'X', 'tags': ['a', 'b']}}
+TEXT = json.dumps(CONTENT).encode('utf-8')
+SIGS = Morlock.CONTAINERS['mp3'].sigs
+
+def load(tmp_path, data: bytes) -> tuple:
+    'readheader and readfile on `data` saved as an MP3'
+
+    path = tmp_path / 'track.mp3'
+    path.write_bytes(data)
+    header = Morlock.readheader(str(path), Morlock.CONTAINERS['mp3'])[1]
+    return header, Morlock.readfile(str(path))
+
+def check(tmp_path, data: bytes, content: dict = CONTENT) -> None:
+    'Both locators agree, and the audio starts where AUDIO was put'
+
+    audiostart = data.rfind(AUDIO)
+    header, (st, offset, version, flags, decoded, digest, bytesread) = load(tmp_path, data)
+    assert Morlock.locateheader(data, SIGS) == header
+    assert header[2] == offset == audiostart
+    assert data[header[1]:audiostart] == b'</morlock>'
+    assert version == 0 and decoded == content
+
+def test_plain(tmp_path):
+    check(tmp_path, b'<morlock>' + TEXT + b'</morlock>' + AUDIO)
+
+def test_garbage_prefixed(tmp_path):
+    check(tmp_path, b'<morlock>\x00\x01garbage}{' + TEXT + b'</morlock>' + AUDIO)
+    check(tmp_path, b'junk before<morlock>' + TEXT + b'</morlock>' + AUDIO)
+
+def test_whitespace_padded(tmp_path):
+    check(tmp_path, b'<morlock>\n  ' + TEXT + b'\n\t </morlock>' + AUDIO)
+
+def test_doubled_tags(tmp_path):
+    check(tmp_path, b'<morlock><morlock>' + TEXT + b'</morlock></morlock>' + AUDIO)
+    check(tmp_path, b'<morlock>' + TEXT + b'</morlock><morlock></morlock>' + AUDIO)
+
+def test_multiple_signatures(tmp_path):
+    # Signatures in the audio after the first don't move its start
+    check(tmp_path, b'<morlock>' + TEXT + b'</morlock>' + AUDIO + b'\xc3\xbf\xc3\xbbID3OggS</morlock>ID3')
+
+def test_signature_inside_header(tmp_path):
+    content = {'name': 'ID3', 'password': None, 'data': {'sync': 'ÿû ÿó ÿò', 'tag': 'ID3\x04'}}
+    text = json.dumps(content, ensure_ascii=False).encode('utf-8')
+    assert all(sig in text for sig in SIGS)
+    check(tmp_path, b'<morlock>' + text + b'</morlock>' + AUDIO, content)
+
+def test_closing_tag_and_signature_inside_header(tmp_path):
+    # Only a closing tag followed by audio `parse` accepts ends the header
+    data = b'<morlock>{"name": "</morlock>ID3 </morlock>\xc3\xbf\xc3\xbb", "password": null, "data": {}}</morlock>' + AUDIO
+    header, (st, offset, version, flags, content, digest, bytesread) = load(tmp_path, data)
+    assert header[1] == data.rfind(b'</morlock>') and offset == data.rfind(AUDIO)
+    assert content['data'] == {}
+
+def test_closing_tag_across_chunks(tmp_path):
+    # The closing tag straddles the end of the first read
+    boundary = Morlock.FRAME.size + Morlock.CHUNK_SIZE
+    content = {'name': 'track', 'password': None, 'data': {'pad': ''}}
+    content['data']['pad'] = 'a' * (boundary - 4 - len('<morlock>') - len(json.dumps(content)))
+    data = b'<morlock>' + json.dumps(content).encode('utf-8') + b'</morlock>' + AUDIO
+    assert data.find(b'</morlock>') == boundary - 4
+    check(tmp_path, data, content)
+
+def test_no_signature(tmp_path):
+    data = b'<morlock>' + TEXT + b'</morlock>' + bytes(64)
+    assert Morlock.locateheader(data, SIGS) == (9, 9 + len(TEXT), None)
+
+    path = tmp_path / 'track.mp3'
+    path.write_bytes(data)
+    with pytest.raises(ValueError):
+        Morlock.readfile(str(path))
+
+def test_no_header(tmp_path):
+    assert Morlock.locateheader(AUDIO, SIGS) is None
+    header, (st, offset, version, flags, content, digest, bytesread) = load(tmp_path, AUDIO)
+    assert header is None and content is None
+
+def test_readfile_framed(tmp_path):
+    path = tmp_path / 'track.mp3'
+    path.write_bytes(AUDIO)
+    morlockfile = Morlock.MorlockFile(str(path), 0, dict(CONTENT))
+    morlockfile.codec = Morlock.FLAG_BINARY
+    morlockfile.write()
+
+    st, offset, version, flags, content, digest, bytesread = Morlock.readfile(str(path), lazy=True)
+    assert offset == morlockfile.offset and digest == morlockfile.digest
+    assert version == Morlock.FRAME_VERSION and flags == Morlock.FLAG_BINARY
+    assert isinstance(content, Morlock.MorlockContent) and content == CONTENT
+
+    # A header known by its digest isn't decoded
+    assert Morlock.readfile(str(path), known=digest)[4:6] == (None, digest)
+    assert Morlock.readfile(str(path), known=bytes(16))[4] == CONTENT
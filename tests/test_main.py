@@ -0,0 +1,29 @@
+import main
+import Morlock
+
+AUDIO = b'ID3\x04\x00\x00\x00\x00\x00\x10' + bytes(16) + b'\xff\xfb\x90\x64' + bytes(64)
+
+def test_exec_quoted_paths(tmp_path, monkeypatch, capsys):
+    # Arguments are quoted again for the commands, so names with spaces survive the round trip
+    monkeypatch.chdir(tmp_path)
+    for name in ('sp ace.mp3', 'b.mp3'):
+        (tmp_path / name).write_bytes(AUDIO)
+
+    argv = ['--name', 'n', 'load', 'sp ace.mp3', 'b.mp3', ';', 'activate', 'sp ace.mp3', ';', 'set', 'k', '1', ';',
+            'switch', 'b.mp3', ';', 'switch', 'sp ace.mp3', ';', 'set', 'k', '2', ';', 'save', 'sp ace.mp3']
+    assert main.execute(argv) == 0
+
+    out = capsys.readouterr().out
+    assert "'sp ace.mp3' activated successfully." in out and not 'not currently loaded' in out
+    assert Morlock.readfile(str(tmp_path / 'sp ace.mp3'))[4]['data'] == {'k': 2}
+
+def test_exec_activate_one_file(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'a.mp3').write_bytes(AUDIO)
+
+    assert main.execute(['--name', 'n', 'load', 'a.mp3', ';', 'activate', 'a.mp3', 'b.mp3', ';', 'switch']) == 0
+    assert capsys.readouterr().out.count('A single file must be provided.') == 2
+
+def test_exec_unknown_command(capsys):
+    assert main.execute(['bogus']) == 2
+    assert "Unknown command 'bogus'." in capsys.readouterr().err
@@ -0,0 +1,183 @@
+import copy
+import pytest
+import Morlock
+
+DATA = {'artist': {'name': 'X', 'members': ['a', 'b']}, 'tags': [1, 2], 'cues': [{'t': 1}, {'t': 2}], 'a': {'a': 0}}
+
+def setkey(data: dict, key: str, val) -> bool:
+    return Morlock.setkey(data, Morlock.compilekey(key), val)
+
+def patch(data: dict, operations) -> bool:
+    return Morlock.applypatch(data, Morlock.compilepatch(operations))
+
+@pytest.mark.parametrize('key, steps', [
+    ('a', ('a',)),
+    ('family.brothers[0].son', ('family', 'brothers', 0, 'son')),
+    ('a[0][12].b', ('a', 0, 12, 'b')),
+    ('a.b.a', ('a', 'b', 'a'))
+])
+def test_compilekey(key, steps):
+    assert Morlock.compilekey(key) == steps
+
+@pytest.mark.parametrize('key, message', [
+    ('a b', 'Forbidden characters'),
+    ('a-b', 'Forbidden characters'),
+    ('a[0', 'Invalid key'),
+    ('a[]', 'Invalid key'),
+    ('[0]', 'invalid key'),
+    ('a[x]', 'non-digit index'),
+    ('a[-1]', 'Forbidden characters')
+])
+def test_compilekey_invalid(key, message):
+    with pytest.raises(ValueError, match=message):
+        Morlock.compilekey(key)
+
+def test_set_after_list_index():
+    # Steps after `[0]` go into the element, not its list's parent
+    data = copy.deepcopy(DATA)
+    assert setkey(data, 'cues[0].label', 'intro')
+    assert data['cues'] == [{'t': 1, 'label': 'intro'}, {'t': 2}]
+    assert not 'label' in data
+
+def test_set_repeated_names():
+    # Intermediate keys named like the last one are still containers on the way
+    data = copy.deepcopy(DATA)
+    assert setkey(data, 'a.a', 1) and data['a'] == {'a': 1}
+
+    assert setkey(data, 'x.y.x', 2) and data['x'] == {'y': {'x': 2}}
+    assert setkey(data, 'x.x', 3) and data['x'] == {'y': {'x': 2}, 'x': 3}
+
+def test_set_list_element():
+    # An element is compared with itself, not looked up by value
+    data = copy.deepcopy(DATA)
+    assert setkey(data, 'tags[1]', 1) and data['tags'] == [1, 1]
+    assert not setkey(data, 'tags[0]', 1)
+
+def test_set_creates_containers():
+    data = copy.deepcopy(DATA)
+    assert setkey(data, 'new.list[0].name', 'n')
+    assert data['new'] == {'list': [{'name': 'n'}]}
+
+    # Values of the wrong type are replaced
+    assert setkey(data, 'artist.name.first', 'Y') and data['artist']['name'] == {'first': 'Y'}
+    assert setkey(data, 'tags.x', 1) and data['tags'] == {'x': 1}
+
+def test_set_append_and_out_of_bounds():
+    data = copy.deepcopy(DATA)
+    assert setkey(data, 'artist.members[2]', 'c')
+    assert data['artist']['members'] == ['a', 'b', 'c']
+
+    with pytest.raises(IndexError, match='out of bounds'):
+        setkey(data, 'artist.members[4]', 'e')
+
+def test_set_rolls_back():
+    # Containers made on the way to a bad index are removed again
+    data = copy.deepcopy(DATA)
+    with pytest.raises(IndexError):
+        setkey(data, 'new.list[1]', 1)
+    with pytest.raises(IndexError):
+        setkey(data, 'artist.name.list[1]', 1)
+    with pytest.raises(IndexError):
+        setkey(data, 'cues[0].t[1]', 1)
+
+    assert data == DATA
+
+def test_set_unchanged():
+    data = copy.deepcopy(DATA)
+    assert not setkey(data, 'artist.name', 'X')
+    assert not setkey(data, 'cues[1]', {'t': 2})
+    assert data == DATA
+
+def test_patch_object():
+    data = copy.deepcopy(DATA)
+    assert patch(data, {'artist.name': 'Y', 'tags[2]': 3, 'cues[0].t': 5})
+    assert data['artist']['name'] == 'Y' and data['tags'] == [1, 2, 3] and data['cues'][0] == {'t': 5}
+    assert not patch(data, {'artist.name': 'Y'})
+
+def test_patch_operations():
+    data = copy.deepcopy(DATA)
+    assert patch(data, [
+        {'op': 'test', 'path': '/artist/name', 'value': 'X'},
+        {'op': 'add', 'path': '/tags/0', 'value': 0},
+        {'op': 'add', 'path': '/tags/-', 'value': 3},
+        {'op': 'add', 'path': '/artist/name', 'value': 'Y'},
+        {'op': 'add', 'path': '/a~1b', 'value': {'c~d': 1}},
+        {'op': 'replace', 'path': '/a~1b/c~0d', 'value': 2},
+        {'op': 'remove', 'path': '/cues/0'},
+        {'op': 'replace', 'path': '/cues/0/t', 'value': 3}
+    ])
+
+    assert data == {'artist': {'name': 'Y', 'members': ['a', 'b']}, 'tags': [0, 1, 2, 3], 'cues': [{'t': 3}], 'a': {'a': 0}, 'a/b': {'c~d': 2}}
+
+@pytest.mark.parametrize('failing', [
+    {'op': 'test', 'path': '/artist/name', 'value': 'Z'},
+    {'op': 'test', 'path': '/artist/missing', 'value': 1},
+    {'op': 'remove', 'path': '/tags/2'},
+    {'op': 'replace', 'path': '/tags/2', 'value': 1},
+    {'op': 'add', 'path': '/tags/3', 'value': 1},
+    {'op': 'add', 'path': '/missing/x', 'value': 1},
+    {'op': 'add', 'path': '/artist/name/x', 'value': 1},
+    {'op': 'replace', 'path': '/tags/01', 'value': 1},
+    {'op': 'remove', 'path': '/tags/-'},
+    {'op': 'remove', 'path': ''}
+])
+def test_patch_rolls_back(failing):
+    # A failure halfway leaves `data` as it was, whatever ran before it
+    data = copy.deepcopy(DATA)
+    before = [
+        {'op': 'add', 'path': '/tags/1', 'value': 9},
+        {'op': 'remove', 'path': '/tags/1'},
+        {'op': 'remove', 'path': '/cues/0'},
+        {'op': 'add', 'path': '/new', 'value': {'x': [1]}},
+        {'op': 'replace', 'path': '/artist/members/0', 'value': 'z'}
+    ]
+    after = [{'op': 'add', 'path': '/after', 'value': 1}]
+
+    with pytest.raises(ValueError):
+        patch(data, before + [failing] + after)
+
+    assert data == DATA
+
+def test_patch_object_rolls_back():
+    data = copy.deepcopy(DATA)
+    with pytest.raises(ValueError, match='out of bounds'):
+        patch(data, {'artist.name': 'Y', 'new.x': 1, 'tags[5]': 1, 'after': 1})
+
+    assert data == DATA
+
+def test_patch_values_are_copied():
+    data = copy.deepcopy(DATA)
+    value = {'x': [1]}
+    patch(data, [{'op': 'add', 'path': '/a1', 'value': value}, {'op': 'add', 'path': '/a2', 'value': value}])
+    data['a1']['x'].append(2)
+    assert data['a2'] == {'x': [1]} and value == {'x': [1]}
+
+@pytest.mark.parametrize('operations, message', [
+    ('nope', 'JSON object or a list'),
+    ([{'op': 'add'}], 'needs an `op` and a `path`'),
+    ([{'op': 'move', 'path': '/a', 'from': '/b'}], "Unsupported patch operation 'move'"),
+    ([{'op': 'add', 'path': '/a'}], 'needs a `value`'),
+    ([{'op': 'add', 'path': 'a', 'value': 1}], 'not a JSON Pointer'),
+    ({'a b': 1}, 'Forbidden characters')
+])
+def test_compilepatch_invalid(operations, message):
+    with pytest.raises(ValueError, match=message):
+        Morlock.compilepatch(operations)
+
+def test_set_copies_values_per_file(tmp_path):
+    paths = []
+    for name in ('a.mp3', 'b.mp3'):
+        path = tmp_path / name
+        path.write_bytes(b'ID3\x04\x00\x00\x00\x00\x00\x10' + bytes(16) + b'\xff\xfb\x90\x64')
+        Morlock.MorlockFile(str(path), 0, {'name': name, 'password': None, 'data': {}}).write()
+        paths.append(str(path))
+
+    cli = Morlock.MorlockCli()
+    cli.interactive = False
+    cli.execute('load {} {}'.format(*paths))
+    cli.execute('set list [1] {} {}'.format(*paths))
+
+    a, b = (cli.loadedfiles.get(path) for path in paths)
+    a.content['data']['list'].append(2)
+    assert b.content['data']['list'] == [1]
+    assert a.modified and b.modified
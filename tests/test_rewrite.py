@@ -0,0 +1,47 @@
+import os
+import Morlock
+
+AUDIO = b'ID3\x04\x00\x00\x00\x00\x00\x10' + bytes(16) + b'\xff\xfb\x90\x64' + bytes(1000)
+
+def test_rewrite(tmp_path):
+    path = tmp_path / 'track.mp3'
+    path.write_bytes(b'old header' + AUDIO)
+
+    Morlock.rewritefile(str(path), b'new', 10)
+    assert path.read_bytes() == b'new' + AUDIO
+    assert [p.name for p in tmp_path.iterdir()] == ['track.mp3']
+
+def test_rewrite_symlink(tmp_path):
+    # The link's target gets the new content, and the link stays a link
+    real = tmp_path / 'real.mp3'
+    real.write_bytes(b'old header' + AUDIO)
+    link = tmp_path / 'link.mp3'
+    link.symlink_to(real)
+
+    Morlock.rewritefile(str(link), b'a longer new header', 10)
+    assert link.is_symlink()
+    assert real.read_bytes() == b'a longer new header' + AUDIO
+
+def test_rewrite_hardlink(tmp_path):
+    real = tmp_path / 'real.mp3'
+    real.write_bytes(b'old header' + AUDIO)
+    other = tmp_path / 'other.mp3'
+    os.link(real, other)
+
+    for header in (b'a longer new header', b'short'):
+        Morlock.rewritefile(str(real), header, len(real.read_bytes()) - len(AUDIO))
+        assert os.path.samefile(real, other)
+        assert other.read_bytes() == header + AUDIO
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['other.mp3', 'real.mp3']
+
+def test_save_symlink(tmp_path):
+    real = tmp_path / 'real.mp3'
+    real.write_bytes(AUDIO)
+    link = tmp_path / 'link.mp3'
+    link.symlink_to(real)
+
+    morlockfile = Morlock.MorlockFile(str(link), 0, {'name': 'x', 'password': None, 'data': {'k': 1}})
+    assert morlockfile.write()
+    assert link.is_symlink()
+    assert Morlock.readfile(str(real))[4]['data'] == {'k': 1}
@@ -0,0 +1,65 @@
+import json
+import pytest
+import Morlock
+
+pytest.importorskip('werkzeug')
+from werkzeug.test import Client
+import server
+
+AUDIO = b'ID3\x04\x00\x00\x00\x00\x00\x10' + bytes(16) + b'\xff\xfb\x90\x64' + bytes(64)
+
+@pytest.fixture
+def client():
+    return Client(server.MorlockService())
+
+def post(client, op: str, body: dict) -> tuple[int, dict]:
+    response = client.post('/' + op, data=json.dumps(body))
+    assert response.mimetype == 'application/json'
+    return response.status_code, json.loads(response.get_data())
+
+def makefile(tmp_path, name: str = 'a.mp3') -> str:
+    path = tmp_path / name
+    path.write_bytes(AUDIO)
+    Morlock.MorlockFile(str(path), 0, {'name': 'a', 'password': None, 'data': {'k': 1}}).write()
+    return str(path)
+
+def test_load_get_set(client, tmp_path):
+    path = makefile(tmp_path)
+    assert post(client, 'load', {'paths': [path]})[1]['results'][0]['loaded']
+    assert post(client, 'set', {'paths': [path], 'key': 'k', 'value': 2})[1] == {'results': [{'path': path, 'changed': True}]}
+    assert post(client, 'get', {'paths': [path], 'key': 'k'})[1] == {'results': [{'path': path, 'value': 2}]}
+
+def test_load_unreadable(client, tmp_path, monkeypatch):
+    path = makefile(tmp_path)
+
+    def denied(path: str, *args, **kwargs):
+        raise PermissionError(13, 'Permission denied', path)
+
+    monkeypatch.setattr(server, 'readfile', denied)
+    assert post(client, 'load', {'paths': [path]}) == (200, {'results': [{'path': path, 'error': 'Permission denied'}]})
+
+def test_key_not_string(client, tmp_path):
+    path = makefile(tmp_path)
+    post(client, 'load', {'paths': [path]})
+
+    for op in ('get', 'set'):
+        status, body = post(client, op, {'paths': [path], 'key': 5, 'value': 1})
+        assert status == 400 and body == {'error': '`key` must be a string.'}
+
+def test_batch_isolates_errors(client, tmp_path):
+    path = makefile(tmp_path)
+    status, body = post(client, 'batch', {'requests': [
+        {'op': 'load', 'paths': [path]},
+        {'op': 'get', 'paths': [path], 'key': 5},
+        {'op': 'get', 'paths': 5},
+        {'op': 'nope'},
+        {'op': 'get', 'paths': [path], 'key': 'k'}
+    ]})
+
+    assert status == 200
+    assert body['results'][1:] == [
+        {'error': '`key` must be a string.'},
+        {'error': '`paths` must be a list of paths or "all".'},
+        {'error': 'unknown op'},
+        [{'path': path, 'value': 1}]
+    ]
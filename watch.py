@@ -0,0 +1,71 @@
+import os, ctypes, ctypes.util, errno, select, struct
+
+# inotify events meaning a file in a watched directory may have a new header
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+# struct inotify_event: watch descriptor, mask, cookie and name length, then the name
+EVENT = struct.Struct('iIII')
+
+class Inotify:
+    'Directory watches through the Linux inotify API, called with ctypes'
+
+    def __init__(self) -> None:
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            init = self.libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+        self.directories: dict[int, str] = {}
+
+    def add(self, directory: str) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), directory)
+
+        self.directories[wd] = directory
+
+    def read(self, timeout: float) -> set[str]:
+        """Wait up to `timeout` seconds for events and return the paths they
+        are about; None when events were lost and anything may have changed.
+        """
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        paths = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return paths
+
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, pos)
+                name = data[pos + EVENT.size:pos + EVENT.size + length].rstrip(b'\0')
+                pos += EVENT.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    return None
+
+                if wd in self.directories and name:
+                    paths.add(os.path.join(self.directories[wd], os.fsdecode(name)))
+
+    def close(self) -> None:
+        os.close(self.fd)